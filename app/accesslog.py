@@ -0,0 +1,124 @@
+import json
+import logging
+import os
+
+from collections import deque
+from threading import Event, Thread
+from time import localtime, strftime, time
+from const import *
+
+
+class AccessLog:
+    def __init__(self, path, format=ACCESS_LOG_COMBINED, max_bytes=ACCESS_LOG_MAX_BYTES, backups=ACCESS_LOG_BACKUPS,
+                 queue_size=ACCESS_LOG_QUEUE_SIZE, overflow=ACCESS_LOG_DROP_NEW, interval=ACCESS_LOG_INTERVAL):
+        self.path = path
+        self.format = format
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.queue_size = queue_size
+        self.drop_new = overflow == ACCESS_LOG_DROP_NEW
+        self.interval = interval
+        self.queue = deque(maxlen=queue_size)
+        self.dropped = 0
+        self.written = 0
+        self.file = None
+        self.stopped = Event()
+        self.thread = None
+
+    def log(self, peer, request, status, sent, duration):
+        if len(self.queue) >= self.queue_size:
+            self.dropped += 1
+            if self.drop_new:
+                return
+        if request is None:
+            self.queue.append((time(), peer, None, None, None, status, sent, None, None, duration))
+            return
+        self.queue.append((time(), peer, request.method, request.url, request.version, status, sent,
+                           request.headers.get("referer"), request.headers.get("user-agent"), duration))
+
+    def start(self):
+        self.open()
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                logging.exception("Access log error:")
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+        self.flush()
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def open(self):
+        self.file = open(self.path, "a", encoding="utf8", buffering=ACCESS_LOG_BUFFER)
+
+    def reopen(self):
+        if self.file:
+            self.file.close()
+        self.open()
+
+    def flush(self):
+        lines = []
+        while True:
+            try:
+                entry = self.queue.popleft()
+            except IndexError:
+                break
+            lines.append(self.format_entry(entry))
+        if not lines or not self.file:
+            return
+
+        try:
+            if os.stat(self.path).st_ino != os.fstat(self.file.fileno()).st_ino:
+                self.reopen()
+        except FileNotFoundError:
+            self.reopen()
+        self.file.write("".join(lines))
+        self.file.flush()
+        self.written += len(lines)
+        if self.max_bytes and self.file.tell() >= self.max_bytes:
+            self.rotate()
+
+    def rotate(self):
+        self.file.close()
+        for i in range(self.backups - 1, 0, -1):
+            source = f"{self.path}.{i}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{i + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.open()
+
+    def format_entry(self, entry):
+        timestamp, peer, method, url, version, status, sent, referer, user_agent, duration = entry
+        if self.format == ACCESS_LOG_JSON:
+            return json.dumps({
+                "time": strftime("%Y-%m-%dT%H:%M:%S%z", localtime(timestamp)),
+                "remote_addr": peer,
+                "method": method,
+                "url": url,
+                "version": version,
+                "status": status,
+                "bytes": sent,
+                "referer": referer,
+                "user_agent": user_agent,
+                "duration": round(duration, 6),
+            }, ensure_ascii=False) + "\n"
+        request_line = f"{quote(method)} {quote(url)} {quote(version)}" if method else "-"
+        return (f'{peer} - - [{strftime("%d/%b/%Y:%H:%M:%S %z", localtime(timestamp))}] '
+                f'"{request_line}" {status} {sent} '
+                f'"{quote(referer or "-")}" "{quote(user_agent or "-")}"\n')
+
+
+def quote(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"')
@@ -1,19 +1,159 @@
 HTTP_STR_END = b"\r\n"
 HTTP_END = b"\r\n\r\n"
 
+CONNECTION_KEEP_ALIVE = b"\r\nConnection: keep-alive\r\n\r\n"
+CONNECTION_CLOSE = b"\r\nConnection: close\r\n\r\n"
+
 SERVER_NAME = "SERVER 3000 XXL TURBO"
 
 UNKNOWN = "UNKNOWN"
 
+HTTP_1_0 = "HTTP/1.0"
+HTTP_1_1 = "HTTP/1.1"
+
 OK = 200
+PARTIAL_CONTENT = 206
+NOT_MODIFIED = 304
+BAD_REQUEST = 400
 FORBIDDEN = 403
 NOT_FOUND = 404
 NOT_ALLOWED = 405
+LENGTH_REQUIRED = 411
+RANGE_NOT_SATISFIABLE = 416
+HEADER_FIELDS_TOO_LARGE = 431
+BAD_GATEWAY = 502
+SERVICE_UNAVAILABLE = 503
+GATEWAY_TIMEOUT = 504
+
+CACHEABLE = (OK, PARTIAL_CONTENT, NOT_MODIFIED)
+
+MAX_RANGES = 16
 
 INDEX_PATH = "index.html"
 
-SOCKET_PART_SIZE = 1024
+SOCKET_PART_SIZE = 16 * 1024
+
+SENDFILE_MIN_SIZE = 64 * 1024
+SENDFILE_SLICE_SIZE = 128 * 1024
+
+DEFAULT_CONTENT_TYPE = "application/octet-stream"
+MIME_TYPES = {
+    "html": "text/html",
+    "htm": "text/html",
+    "css": "text/css",
+    "txt": "text/plain",
+    "csv": "text/csv",
+    "md": "text/markdown",
+    "xml": "application/xml",
+    "js": "application/javascript",
+    "mjs": "application/javascript",
+    "json": "application/json",
+    "map": "application/json",
+    "webmanifest": "application/manifest+json",
+    "wasm": "application/wasm",
+    "pdf": "application/pdf",
+    "zip": "application/zip",
+    "gz": "application/gzip",
+    "swf": "application/x-shockwave-flash",
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "png": "image/png",
+    "gif": "image/gif",
+    "webp": "image/webp",
+    "avif": "image/avif",
+    "ico": "image/x-icon",
+    "svg": "image/svg+xml",
+    "woff": "font/woff",
+    "woff2": "font/woff2",
+    "ttf": "font/ttf",
+    "otf": "font/otf",
+    "mp3": "audio/mpeg",
+    "ogg": "audio/ogg",
+    "wav": "audio/wav",
+    "mp4": "video/mp4",
+    "webm": "video/webm",
+}
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "application/xml",
+                      "application/wasm", "image/svg+xml", "image/x-icon", "font/ttf", "font/otf")
+COMPRESSIBLE_SUFFIXES = ("+json", "+xml")
+
+COMPRESS_MIN_SIZE = 256
+COMPRESS_MAX_SIZE = 4 * 1024 * 1024
+
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+CACHE_TTL = 60
+
+MMAP_MAX_MAPPINGS = 1024
+MMAP_FD_SHARE = 0.5
+
+INDEX_INTERVAL = 2
+INDEX_FULL_INTERVAL = 60
+MISSING_CACHE_SIZE = 10000
+HEAD_CACHE_SIZE = 10000
 
 STOP_TASK = "STOP_TASK"
 
-MAX_REQUEST_SIZE = 2048
\ No newline at end of file
+MAX_REQUEST_SIZE = 8 * 1024
+MAX_HEADERS = 100
+
+KEEP_ALIVE_TIMEOUT = 5
+KEEP_ALIVE_MAX = 100
+
+HEADER_TIMEOUT = 10
+REQUEST_TIMEOUT = 30
+SEND_TIMEOUT = 10
+MIN_RATE = 1024
+
+DRAIN_TIMEOUT = 30
+DRAIN_INTERVAL = 0.1
+ACCEPT_INTERVAL = 1
+LISTEN_FD_ENV = "HTTPD_LISTEN_FD"
+RETIRED_PIDS_ENV = "HTTPD_RETIRED_PIDS"
+
+ACCESS_LOG_COMBINED = "combined"
+ACCESS_LOG_JSON = "json"
+ACCESS_LOG_FORMATS = (ACCESS_LOG_COMBINED, ACCESS_LOG_JSON)
+ACCESS_LOG_DROP_NEW = "drop-new"
+ACCESS_LOG_DROP_OLD = "drop-old"
+ACCESS_LOG_OVERFLOWS = (ACCESS_LOG_DROP_NEW, ACCESS_LOG_DROP_OLD)
+ACCESS_LOG_QUEUE_SIZE = 10000
+ACCESS_LOG_MAX_BYTES = 100 * 1024 * 1024
+ACCESS_LOG_BACKUPS = 5
+ACCESS_LOG_INTERVAL = 0.2
+ACCESS_LOG_BUFFER = 256 * 1024
+
+WARMUP_WORKERS = 8
+
+POOL_MAX_WORKERS = 256
+POOL_IDLE_TIMEOUT = 30
+POOL_GROW_DEPTH = 1
+POOL_GROW_WAIT = 0.05
+
+LISTEN_BACKLOG = 1024
+
+PROXY_POOL_SIZE = 32
+PROXY_CONNECT_TIMEOUT = 2
+PROXY_TIMEOUT = 30
+PROXY_HEALTH_INTERVAL = 5
+PROXY_FAIL_TIMEOUT = 5
+PROXY_MAX_HEAD = 64 * 1024
+PROXY_NO_BODY = "none"
+PROXY_LENGTH = "length"
+PROXY_CHUNKED = "chunked"
+PROXY_UNTIL_CLOSE = "close"
+HOP_BY_HOP_HEADERS = ("connection", "keep-alive", "proxy-connection", "te", "trailer", "transfer-encoding",
+                      "upgrade")
+
+QUEUE_SIZE = 1024
+QUEUE_TIMEOUT = 10
+RETRY_AFTER = 1
+
+ENGINE_THREAD = "thread"
+ENGINE_ASYNC = "async"
+ENGINES = (ENGINE_THREAD, ENGINE_ASYNC)
+
+RESPAWN_DELAY = 1
+READY_TIMEOUT = 30
+
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4"
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
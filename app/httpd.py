@@ -1,109 +1,634 @@
 import argparse
+import asyncio
 import logging
 import os.path
+import signal
 
-from time import sleep
-from socket import AF_INET, SOCK_STREAM, socket
+from time import monotonic, perf_counter, sleep
+from socket import SHUT_RD, timeout
 from const import *
-from response import Response, CacheContent
-from request import Request
-from multiprocessing.dummy import Pool as ThreadPool
+from response import Response, CacheContent, time_left
+from request import RequestError, RequestParser
+from supervisor import Supervisor
+from index import PathIndex
+from metrics import Metrics
+from accesslog import AccessLog
+from warmup import Warmup
+from mime import MimeRegistry
+from listener import Listener, peer_address
+from pool import WorkerPool
+from proxy import Proxy, ProxyError, Upstream
 from multiprocessing import cpu_count
+from threading import BoundedSemaphore, Event, Thread
 
 
 class Worker:
-    def __call__(self, socket, dir, cache=None,):
+    def __init__(self, keep_alive_timeout=KEEP_ALIVE_TIMEOUT, keep_alive_max=KEEP_ALIVE_MAX,
+                 metrics=None, metrics_path=None, accepted=None, admission=None, queue_timeout=None,
+                 timeouts=None, draining=None, connections=None, access_log=None, proxy=None):
+        self.keep_alive_timeout = keep_alive_timeout
+        self.keep_alive_max = keep_alive_max
+        self.metrics = metrics or Metrics()
+        self.metrics_path = metrics_path
+        self.accepted = accepted
+        self.admission = admission
+        self.queue_timeout = queue_timeout
+        self.timeouts = timeouts or Timeouts()
+        self.draining = draining or Event()
+        self.connections = connections if connections is not None else {}
+        self.access_log = access_log
+        self.proxy = proxy
+        self.parser = RequestParser(keep_body=proxy.match if proxy else None)
+        self.chunk = memoryview(bytearray(SOCKET_PART_SIZE))
+        self.socket = None
+        self.idle = False
+
+    def __call__(self, socket, dir, cache=None, index=None):
+        if self.admission:
+            self.admission.release()
+        self.socket = socket
         try:
-            self.process_connection(socket, dir, cache)
+            self.process_connection(socket, dir, cache, index)
         except Exception:
             logging.exception("Processing error:")
             pass
-
-    def process_connection(self, socket, dir, cache=None):
-        data = self.read_http_data(socket)
-        if not data:
+        finally:
+            self.connections.pop(self, None)
             socket.close()
-            return
-        request = Request(data)
-        response = Response.get_response(request, dir, cache)
-        response_text = response.to_binary()
-        socket.sendall(response_text)
-        socket.close()
-
-    def read_http_data(self, socket):
-        data = b""
-        while True:
-            r = socket.recv(SOCKET_PART_SIZE)
-            data += r
-            if len(r) < 1:
-                data = None
-                break
-            if HTTP_END in r:
-                break
-            if len(data) > MAX_REQUEST_SIZE:
-                break
 
-        if data:
-            return data.decode("utf8")
-        return None
+    def interrupt_idle(self):
+        if self.idle:
+            try:
+                self.socket.shutdown(SHUT_RD)
+            except OSError:
+                pass
+
+    def process_connection(self, socket, dir, cache=None, index=None):
+        self.metrics.inc("http_connections_started_total")
+        if self.accepted:
+            waited = perf_counter() - self.accepted
+            self.metrics.observe("queue", waited)
+            if self.queue_timeout and waited > self.queue_timeout:
+                reject(socket, self.metrics, "deadline")
+                return
+        peer = peer_address(socket.getpeername()) if self.access_log or self.proxy else None
+        for served in range(1, self.keep_alive_max + 1):
+            try:
+                request = self.read_request(socket, idle=served > 1)
+            except timeout:
+                return
+            except RequestError as e:
+                started = perf_counter()
+                try:
+                    sent = Response.get_error_response(e.status, e.info).send(socket)
+                except OSError:
+                    sent = 0
+                self.metrics.record_error_response(e.status, sent)
+                if self.access_log:
+                    self.access_log.log(peer, None, e.status, sent, perf_counter() - started)
+                return
+            if not request:
+                return
+            keep_alive = request.keep_alive and served < self.keep_alive_max and not self.draining.is_set()
+            started = perf_counter()
+            upstream = self.proxy.match(request.url) if self.proxy else None
+            if upstream:
+                keep_alive = self.forward(upstream, request, socket, keep_alive, peer, started)
+                if not keep_alive:
+                    return
+                continue
+            if self.metrics_path and request.url == self.metrics_path:
+                response = Response.get_text_response(self.metrics.render(), METRICS_CONTENT_TYPE, keep_alive)
+            else:
+                response = Response.get_response(request, dir, cache, keep_alive, index)
+            looked_up = perf_counter()
+            head = response.head_to_binary()
+            serialized = perf_counter()
+            deadline = self.timeouts.send_deadline(serialized, len(head) + response.body_length())
+            try:
+                sent = response.send(socket, head, deadline, self.timeouts.send)
+            except timeout:
+                self.metrics.inc("http_timeouts_total", label=("phase", "send"))
+                return
+            except EOFError as e:
+                logging.warning(e)
+                return
+            self.metrics.record_response(response.content.content_status, sent, started, looked_up, serialized)
+            if self.access_log:
+                self.access_log.log(peer, request, response.content.content_status, sent, perf_counter() - started)
+            if not keep_alive:
+                return
+
+    def forward(self, upstream, request, socket, keep_alive, peer, started):
+        try:
+            status, sent, keep_alive, error = self.proxy.forward(upstream, request, socket, self.parser, keep_alive,
+                                                                 peer, self.timeouts)
+        except ProxyError as e:
+            status, sent, keep_alive, error = e.status, 0, False, e.reason
+            try:
+                sent = Response.get_error_response(e.status, e.info).send(socket)
+            except OSError:
+                pass
+        if error:
+            self.metrics.inc("proxy_errors_total", label=("reason", error))
+        self.metrics.record_proxy_response(status, sent, started)
+        if self.access_log:
+            self.access_log.log(peer, request, status, sent, perf_counter() - started)
+        return keep_alive
+
+    def read_request(self, socket, idle=False):
+        request = self.parser.parse()
+        started = None
+        socket.settimeout(self.keep_alive_timeout)
+        while request is None:
+            self.idle = idle and started is None
+            if started is not None:
+                socket.settimeout(self.phase_time_left("header", started + self.timeouts.header))
+            size = socket.recv_into(self.chunk)
+            if size < 1:
+                return None
+            if started is None:
+                started = perf_counter()
+            self.parser.feed(self.chunk[:size])
+            request = self.parser.parse()
+        self.idle = False
+        if started is not None:
+            self.metrics.observe("read", perf_counter() - started)
+
+        started = started or perf_counter()
+        while self.parser.body_left:
+            socket.settimeout(self.phase_time_left("request", started + self.timeouts.request))
+            size = socket.recv_into(self.chunk)
+            if size < 1:
+                return None
+            self.parser.feed(self.chunk[:size])
+        return request
+
+    def phase_time_left(self, phase, deadline):
+        try:
+            return time_left(deadline)
+        except timeout:
+            self.metrics.inc("http_timeouts_total", label=("phase", phase))
+            raise
+
+
+class Timeouts:
+    def __init__(self, header=HEADER_TIMEOUT, request=REQUEST_TIMEOUT, send=SEND_TIMEOUT, min_rate=MIN_RATE):
+        self.header = header
+        self.request = request
+        self.send = send
+        self.min_rate = min_rate
+
+    def send_deadline(self, started, size):
+        allowance = size / self.min_rate if self.min_rate else 0
+        return started + self.send + allowance
+
+
+def reject(socket, metrics, reason):
+    metrics.inc("http_rejected_total", label=("reason", reason))
+    response = Response.get_error_response(SERVICE_UNAVAILABLE, "Service Unavailable", {"Retry-After": RETRY_AFTER})
+    response.send(socket)
 
 
 def clear_cache(cache, run_each_minutes=1):
     while True:
         cache.clear()
+        logging.debug(f"Cache stats: {cache.stats()}")
         sleep(run_each_minutes * 60)
 
 
 class Server:
-    def __init__(self, workers_count, root_directory, port):
+    def __init__(self, workers_count, root_directory, port,
+                 keep_alive_timeout=KEEP_ALIVE_TIMEOUT, keep_alive_max=KEEP_ALIVE_MAX, reuse_port=False,
+                 cache_max_bytes=CACHE_MAX_BYTES, cache_ttl=CACHE_TTL, index_interval=INDEX_INTERVAL,
+                 index_full_interval=INDEX_FULL_INTERVAL,
+                 mmap_max_mappings=None, metrics_path=None, queue_size=QUEUE_SIZE, queue_timeout=QUEUE_TIMEOUT,
+                 timeouts=None, drain_timeout=DRAIN_TIMEOUT, access_log=None, warmup=None, mime_types=None,
+                 max_workers=POOL_MAX_WORKERS, pool_idle_timeout=POOL_IDLE_TIMEOUT, pool_grow_depth=POOL_GROW_DEPTH,
+                 pool_grow_wait=POOL_GROW_WAIT, listener=None, acceptors=1, proxy=None):
         self.workers_count = workers_count
         self.root_directory = root_directory
         self.port = port
-        self.thread_pool = None
+        self.keep_alive_timeout = keep_alive_timeout
+        self.keep_alive_max = keep_alive_max
+        self.listener = listener or Listener(port=port, reuse_port=reuse_port)
+        self.reuse_port = self.listener.reuse_port
+        self.acceptors = acceptors
+        self.proxy = proxy
         self.socket = None
-        self.cache = CacheContent()
+        self.on_ready = None
+        self.cache = CacheContent(cache_max_bytes, cache_ttl, mmap_max_mappings, use_mmap=bool(mmap_max_mappings))
+        self.index_interval = index_interval
+        self.index_full_interval = index_full_interval
+        self.index = None
+        self.metrics_path = metrics_path
+        self.metrics = Metrics()
+        self.thread_pool = WorkerPool(workers_count, max_workers, pool_idle_timeout, pool_grow_depth, pool_grow_wait,
+                                      self.metrics)
+        self.admission = BoundedSemaphore(queue_size)
+        self.queue_timeout = queue_timeout
+        self.timeouts = timeouts or Timeouts()
+        self.drain_timeout = drain_timeout
+        self.draining = Event()
+        self.connections = {}
+        self.access_log = access_log
+        self.warmup = warmup
+        self.mime_types = mime_types or Response.mime_types
+        Response.mime_types = self.mime_types
+        self.register_metrics()
 
-    def run(self):
+    def get_root_dir(self):
         dir = (os.path.abspath(os.path.curdir))
         dir = os.path.join(dir, self.root_directory)
         if not os.path.exists(dir):
             raise FileExistsError(f"Path {dir} not found")
+        return dir
+
+    def register_metrics(self):
+        self.metrics.gauge("http_queue_depth", lambda: self.metrics.value("http_connections_accepted_total")
+                           - self.metrics.value("http_connections_started_total"))
+        for name in ("hits", "misses", "evictions", "coalesced"):
+            self.metrics.gauge(f"cache_{name}_total", lambda name=name: self.cache.stats()[name], "counter")
+        self.metrics.gauge("cache_entries", lambda: self.cache.stats()["entries"])
+        self.metrics.gauge("cache_bytes", lambda: self.cache.stats()["bytes"])
+        self.metrics.gauge("http_connections_active", lambda: len(self.connections))
+        if self.access_log:
+            self.metrics.gauge("access_log_dropped_total", lambda: self.access_log.dropped, "counter")
+        if self.warmup:
+            self.metrics.gauge("warmup_seconds", lambda: self.warmup.seconds)
+            self.metrics.gauge("warmup_bytes", lambda: self.warmup.bytes)
+        if self.proxy:
+            self.metrics.gauge("proxy_upstreams_healthy",
+                               lambda: sum(upstream.available() for upstream in self.proxy.upstreams))
+
+    def register_pool_metrics(self):
+        self.metrics.gauge("pool_threads", lambda: self.thread_pool.stats()["threads"])
+        self.metrics.gauge("pool_idle_threads", lambda: self.thread_pool.stats()["idle"])
+        self.metrics.gauge("pool_queued_tasks", lambda: self.thread_pool.stats()["queued"])
+        self.metrics.gauge("pool_grown_total", lambda: self.thread_pool.stats()["grown"], "counter")
+        self.metrics.gauge("pool_shrunk_total", lambda: self.thread_pool.stats()["shrunk"], "counter")
+
+    def start_access_log(self):
+        if self.access_log:
+            self.access_log.start()
 
-        self.thread_pool = ThreadPool(self.workers_count + 1)
-        self.thread_pool.map_async(clear_cache, [self.cache])
+    def start_index(self, dir):
+        if self.index_interval > 0:
+            self.index = PathIndex(dir, self.index_interval, self.mime_types, self.index_full_interval)
+            self.index.start()
 
-        s = socket(AF_INET, SOCK_STREAM)
+    def warm_up(self, dir):
+        if self.warmup:
+            self.warmup.run(dir, self.cache, self.index)
 
-        self.socket = s
-        s.bind(("", self.port))
-        s.listen(self.workers_count * 2)
+    def listen(self):
+        self.socket = self.listener.open()
+        return self.socket
+
+    def run(self):
+        dir = self.get_root_dir()
+        self.start_index(dir)
+        self.start_access_log()
+        self.warm_up(dir)
+
+        self.thread_pool.start()
+        self.register_pool_metrics()
+        if self.proxy:
+            self.proxy.start()
+        Thread(target=clear_cache, args=(self.cache,), daemon=True).start()
+
+        s = self.socket or self.listen()
+        s.settimeout(ACCEPT_INTERVAL)
+        signal.signal(signal.SIGTERM, self.shutdown)
+        signal.signal(signal.SIGHUP, self.reload)
+        if self.on_ready:
+            self.on_ready()
         logging.info("Server started")
-        while True:
-            c, a = s.accept()
-            self.thread_pool.starmap_async(Worker(), [(c, dir, self.cache)])
+        acceptors = [Thread(target=self.accept, args=(s, dir), daemon=True) for _ in range(self.acceptors - 1)]
+        for acceptor in acceptors:
+            acceptor.start()
+        self.accept(s, dir)
+        for acceptor in acceptors:
+            acceptor.join()
+        self.drain()
+
+    def accept(self, s, dir):
+        while not self.draining.is_set():
+            try:
+                c, a = s.accept()
+            except timeout:
+                continue
+            self.listener.prepare(c)
+            self.metrics.inc("http_connections_accepted_total")
+            if not self.admission.acquire(blocking=False):
+                self.metrics.inc("http_connections_started_total")
+                try:
+                    reject(c, self.metrics, "queue_full")
+                except OSError:
+                    pass
+                c.close()
+                continue
+            worker = Worker(self.keep_alive_timeout, self.keep_alive_max, self.metrics, self.metrics_path,
+                            perf_counter(), self.admission, self.queue_timeout, self.timeouts,
+                            self.draining, self.connections, self.access_log, self.proxy)
+            self.connections[worker] = c
+            self.thread_pool.submit(worker, c, dir, self.cache, self.index)
+
+    def shutdown(self, signum=None, frame=None):
+        self.draining.set()
+
+    def reload(self, signum=None, frame=None):
+        self.cache.purge()
+        Response.head_cache.clear()
+        if self.index:
+            self.index.refresh()
+        logging.info("Caches cleared")
+
+    def drain(self):
+        self.socket.close()
+        logging.info(f"Draining {len(self.connections)} connections")
+        deadline = monotonic() + self.drain_timeout
+        while self.connections and monotonic() < deadline:
+            for worker in list(self.connections):
+                worker.interrupt_idle()
+            sleep(DRAIN_INTERVAL)
+        if self.connections:
+            logging.warning(f"Drain timeout, dropping {len(self.connections)} connections")
+        self.stop()
+        logging.info("Server stopped")
 
     def stop(self):
-        if self.thread_pool:
-            self.thread_pool.terminate()
+        self.thread_pool.stop()
         if self.socket:
             self.socket.close()
+        if self.access_log:
+            self.access_log.stop()
+        if self.warmup:
+            self.warmup.save()
+
+
+class AsyncServer(Server):
+    def run(self):
+        dir = self.get_root_dir()
+        self.start_index(dir)
+        self.start_access_log()
+        self.warm_up(dir)
+        try:
+            asyncio.run(self.serve(dir))
+        finally:
+            if self.access_log:
+                self.access_log.stop()
+            if self.warmup:
+                self.warmup.save()
+
+    async def serve(self, dir):
+        self.dir = dir
+        stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGTERM, stopping.set)
+        loop.add_signal_handler(signal.SIGHUP, self.reload)
+        server = await asyncio.start_server(self.process_connection, sock=self.socket or self.listen())
+        asyncio.create_task(self.clear_cache())
+        if self.on_ready:
+            self.on_ready()
+        logging.info("Server started")
+        await stopping.wait()
+
+        self.draining.set()
+        server.close()
+        logging.info(f"Draining {len(self.connections)} connections")
+        deadline = monotonic() + self.drain_timeout
+        while self.connections and monotonic() < deadline:
+            for writer, idle in list(self.connections.items()):
+                if idle:
+                    writer.transport.close()
+            await asyncio.sleep(DRAIN_INTERVAL)
+        if self.connections:
+            logging.warning(f"Drain timeout, dropping {len(self.connections)} connections")
+        logging.info("Server stopped")
+
+    async def clear_cache(self, run_each_minutes=1):
+        while True:
+            self.cache.clear()
+            logging.debug(f"Cache stats: {self.cache.stats()}")
+            await asyncio.sleep(run_each_minutes * 60)
+
+    async def read_request(self, reader, writer, parser, idle=False):
+        request = parser.parse()
+        started = None
+        while request is None:
+            self.connections[writer] = idle and started is None
+            if started is None:
+                left = self.keep_alive_timeout
+            else:
+                left = self.phase_time_left("header", started + self.timeouts.header)
+            data = await asyncio.wait_for(reader.read(SOCKET_PART_SIZE), left)
+            if not data:
+                return None
+            if started is None:
+                started = perf_counter()
+            parser.feed(data)
+            request = parser.parse()
+        self.connections[writer] = False
+        if started is not None:
+            self.metrics.observe("read", perf_counter() - started)
+
+        started = started or perf_counter()
+        while parser.body_left:
+            left = self.phase_time_left("request", started + self.timeouts.request)
+            data = await asyncio.wait_for(reader.read(SOCKET_PART_SIZE), left)
+            if not data:
+                return None
+            parser.feed(data)
+        return request
+
+    def phase_time_left(self, phase, deadline):
+        try:
+            return time_left(deadline)
+        except TimeoutError:
+            self.metrics.inc("http_timeouts_total", label=("phase", phase))
+            raise
+
+    async def process_connection(self, reader, writer):
+        self.listener.prepare(writer.get_extra_info("socket"))
+        parser = RequestParser()
+        self.metrics.inc("http_connections_accepted_total")
+        self.metrics.inc("http_connections_started_total")
+        self.connections[writer] = False
+        peer = peer_address(writer.get_extra_info("peername")) if self.access_log else None
+        try:
+            for served in range(1, self.keep_alive_max + 1):
+                try:
+                    request = await self.read_request(reader, writer, parser, idle=served > 1)
+                except (asyncio.TimeoutError, TimeoutError):
+                    return
+                except RequestError as e:
+                    started = perf_counter()
+                    try:
+                        sent = await Response.get_error_response(e.status, e.info).send_async(writer)
+                    except OSError:
+                        sent = 0
+                    self.metrics.record_error_response(e.status, sent)
+                    if self.access_log:
+                        self.access_log.log(peer, None, e.status, sent, perf_counter() - started)
+                    return
+                if not request:
+                    return
+                keep_alive = request.keep_alive and served < self.keep_alive_max and not self.draining.is_set()
+                started = perf_counter()
+                if self.metrics_path and request.url == self.metrics_path:
+                    response = Response.get_text_response(self.metrics.render(), METRICS_CONTENT_TYPE, keep_alive)
+                else:
+                    response = Response.get_response(request, self.dir, self.cache, keep_alive, self.index)
+                looked_up = perf_counter()
+                head = response.head_to_binary()
+                serialized = perf_counter()
+                deadline = self.timeouts.send_deadline(serialized, len(head) + response.body_length())
+                try:
+                    sent = await response.send_async(writer, head, deadline)
+                except (asyncio.TimeoutError, TimeoutError):
+                    self.metrics.inc("http_timeouts_total", label=("phase", "send"))
+                    writer.transport.abort()
+                    return
+                except EOFError as e:
+                    logging.warning(e)
+                    writer.transport.abort()
+                    return
+                self.metrics.record_response(response.content.content_status, sent, started, looked_up, serialized)
+                if self.access_log:
+                    self.access_log.log(peer, request, response.content.content_status, sent, perf_counter() - started)
+                if not keep_alive:
+                    return
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            logging.exception("Processing error:")
+        finally:
+            self.connections.pop(writer, None)
+            writer.close()
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-w", "--worker", action="store", type=int, default=cpu_count())
+    parser.add_argument("--max-workers", action="store", type=int, default=POOL_MAX_WORKERS)
+    parser.add_argument("--pool-idle-timeout", action="store", type=float, default=POOL_IDLE_TIMEOUT)
+    parser.add_argument("--pool-grow-depth", action="store", type=int, default=POOL_GROW_DEPTH)
+    parser.add_argument("--pool-grow-wait", action="store", type=float, default=POOL_GROW_WAIT)
     parser.add_argument("-r", "--root", action="store", type=str, default="documents")
     parser.add_argument("-l", "--log", action="store", type=str, default=None)
     parser.add_argument("-p", "--port", action="store", type=int, default=8080)
+    parser.add_argument("--keep-alive-timeout", action="store", type=float, default=KEEP_ALIVE_TIMEOUT)
+    parser.add_argument("--keep-alive-max", action="store", type=int, default=KEEP_ALIVE_MAX)
+    parser.add_argument("-e", "--engine", action="store", type=str, choices=ENGINES, default=ENGINE_THREAD)
+    parser.add_argument("-n", "--processes", action="store", type=int, default=1)
+    parser.add_argument("--host", action="store", type=str, default="")
+    parser.add_argument("--unix", action="store", type=str, default=None)
+    parser.add_argument("--backlog", action="store", type=int, default=LISTEN_BACKLOG)
+    parser.add_argument("--no-reuse-addr", action="store_true")
+    parser.add_argument("--reuse-port", action="store_true")
+    parser.add_argument("--no-nodelay", action="store_true")
+    parser.add_argument("--defer-accept", action="store", type=int, default=0)
+    parser.add_argument("--fastopen", action="store", type=int, default=0)
+    parser.add_argument("--ipv6-only", action="store_true")
+    parser.add_argument("--acceptors", action="store", type=int, default=1)
+    parser.add_argument("--cache-max-bytes", action="store", type=int, default=CACHE_MAX_BYTES)
+    parser.add_argument("--cache-ttl", action="store", type=float, default=CACHE_TTL)
+    parser.add_argument("--index-interval", action="store", type=float, default=INDEX_INTERVAL)
+    parser.add_argument("--index-full-interval", action="store", type=float, default=INDEX_FULL_INTERVAL)
+    parser.add_argument("--mmap", action="store_true")
+    parser.add_argument("--mmap-max-mappings", action="store", type=int, default=MMAP_MAX_MAPPINGS)
+    parser.add_argument("--metrics-path", action="store", type=str, default=None)
+    parser.add_argument("--queue-size", action="store", type=int, default=QUEUE_SIZE)
+    parser.add_argument("--queue-timeout", action="store", type=float, default=QUEUE_TIMEOUT)
+    parser.add_argument("--header-timeout", action="store", type=float, default=HEADER_TIMEOUT)
+    parser.add_argument("--request-timeout", action="store", type=float, default=REQUEST_TIMEOUT)
+    parser.add_argument("--send-timeout", action="store", type=float, default=SEND_TIMEOUT)
+    parser.add_argument("--min-rate", action="store", type=float, default=MIN_RATE)
+    parser.add_argument("--drain-timeout", action="store", type=float, default=DRAIN_TIMEOUT)
+    parser.add_argument("--mime-types", action="store", type=str, default=None)
+    parser.add_argument("--mime-type", action="append", type=str, default=[])
+    parser.add_argument("--cache-control", action="append", type=str, default=[])
+    parser.add_argument("--warmup", action="store_true")
+    parser.add_argument("--warmup-manifest", action="store", type=str, default=None)
+    parser.add_argument("--warmup-snapshot", action="store", type=str, default=None)
+    parser.add_argument("--warmup-max-size", action="store", type=int, default=SENDFILE_MIN_SIZE)
+    parser.add_argument("--warmup-workers", action="store", type=int, default=WARMUP_WORKERS)
+    parser.add_argument("--access-log", action="store", type=str, default=None)
+    parser.add_argument("--access-log-format", action="store", type=str, choices=ACCESS_LOG_FORMATS,
+                        default=ACCESS_LOG_COMBINED)
+    parser.add_argument("--access-log-max-bytes", action="store", type=int, default=ACCESS_LOG_MAX_BYTES)
+    parser.add_argument("--access-log-backups", action="store", type=int, default=ACCESS_LOG_BACKUPS)
+    parser.add_argument("--access-log-queue-size", action="store", type=int, default=ACCESS_LOG_QUEUE_SIZE)
+    parser.add_argument("--access-log-overflow", action="store", type=str, choices=ACCESS_LOG_OVERFLOWS,
+                        default=ACCESS_LOG_DROP_NEW)
+    parser.add_argument("--proxy", action="append", type=str, default=[])
+    parser.add_argument("--proxy-pool-size", action="store", type=int, default=PROXY_POOL_SIZE)
+    parser.add_argument("--proxy-connect-timeout", action="store", type=float, default=PROXY_CONNECT_TIMEOUT)
+    parser.add_argument("--proxy-timeout", action="store", type=float, default=PROXY_TIMEOUT)
+    parser.add_argument("--proxy-health-path", action="store", type=str, default=None)
+    parser.add_argument("--proxy-health-interval", action="store", type=float, default=PROXY_HEALTH_INTERVAL)
+    parser.add_argument("--proxy-fail-timeout", action="store", type=float, default=PROXY_FAIL_TIMEOUT)
     args = parser.parse_args()
+    if args.proxy and args.engine == ENGINE_ASYNC:
+        parser.error("--proxy is supported by the thread engine only")
 
     logging.basicConfig(filename=args.log, level=logging.INFO,
                         format='[%(asctime)s] %(levelname).1s %(message)s', datefmt='%Y.%m.%d %H:%M:%S')
 
-    server = Server(args.worker, args.root, args.port)
+    access_log = None
+    if args.access_log:
+        access_log = AccessLog(args.access_log, args.access_log_format, args.access_log_max_bytes,
+                               args.access_log_backups, args.access_log_queue_size, args.access_log_overflow)
+
+    mime_types = MimeRegistry()
+    if args.mime_types:
+        mime_types.load(args.mime_types)
+    for item in args.mime_type:
+        ext, _, type = item.partition("=")
+        mime_types.add(ext, type)
+    for item in args.cache_control:
+        type, _, max_age = item.partition("=")
+        mime_types.set_policy(type, int(max_age))
+
+    warmup = None
+    if args.warmup or args.warmup_manifest or args.warmup_snapshot:
+        warmup = Warmup(args.warmup_max_size, args.warmup_workers, args.warmup, args.warmup_manifest,
+                        args.warmup_snapshot)
+
+    listener = Listener(args.host, args.port, args.unix, args.backlog, not args.no_reuse_addr, args.reuse_port,
+                        not args.no_nodelay, args.defer_accept, args.fastopen, args.ipv6_only)
+
+    proxy = None
+    if args.proxy:
+        routes = []
+        for item in args.proxy:
+            prefix, _, address = item.partition("=")
+            routes.append((prefix, Upstream(address, args.proxy_pool_size, args.proxy_connect_timeout,
+                                            args.proxy_timeout, args.proxy_health_path,
+                                            args.proxy_health_interval, args.proxy_fail_timeout)))
+        proxy = Proxy(routes)
+
+    server_class = AsyncServer if args.engine == ENGINE_ASYNC else Server
+    server = server_class(args.worker, args.root, args.port,
+                          keep_alive_timeout=args.keep_alive_timeout, keep_alive_max=args.keep_alive_max,
+                          cache_max_bytes=args.cache_max_bytes, cache_ttl=args.cache_ttl,
+                          index_interval=args.index_interval, index_full_interval=args.index_full_interval,
+                          mmap_max_mappings=args.mmap_max_mappings if args.mmap else None,
+                          metrics_path=args.metrics_path,
+                          queue_size=args.queue_size, queue_timeout=args.queue_timeout,
+                          timeouts=Timeouts(args.header_timeout, args.request_timeout, args.send_timeout, args.min_rate),
+                          drain_timeout=args.drain_timeout, access_log=access_log,
+                          warmup=warmup, mime_types=mime_types,
+                          max_workers=args.max_workers, pool_idle_timeout=args.pool_idle_timeout,
+                          pool_grow_depth=args.pool_grow_depth, pool_grow_wait=args.pool_grow_wait,
+                          listener=listener, acceptors=args.acceptors, proxy=proxy)
 
     try:
-        server.run()
+        if args.processes > 1:
+            Supervisor(server, args.processes).run()
+        else:
+            server.run()
     except KeyboardInterrupt:
         server.stop()
         logging.info("Work interrupted")
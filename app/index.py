@@ -0,0 +1,142 @@
+import logging
+import os
+
+from threading import Thread
+from time import monotonic, sleep
+from const import INDEX_FULL_INTERVAL, INDEX_PATH, MISSING_CACHE_SIZE
+
+
+class IndexEntry:
+    def __init__(self, path, stat, mime=None):
+        self.path = path
+        self.stat = stat
+        self.mime = mime
+
+
+class IndexDir:
+    def __init__(self, mtime, keys, subdirs):
+        self.mtime = mtime
+        self.keys = keys
+        self.subdirs = subdirs
+
+
+class PathIndex:
+    def __init__(self, dir, interval, mime_types=None, full_interval=INDEX_FULL_INTERVAL):
+        self.dir = dir
+        self.interval = interval
+        self.mime_types = mime_types
+        self.full_interval = full_interval
+        self.files = {}
+        self.dirs = {}
+        self.resolved = {}
+        self.missing = set()
+        self.full_at = 0
+
+    def start(self):
+        self.refresh()
+        Thread(target=self.watch, daemon=True).start()
+
+    def watch(self):
+        while True:
+            sleep(self.interval)
+            try:
+                self.refresh(full=monotonic() >= self.full_at)
+            except Exception:
+                logging.exception("Index refresh error:")
+
+    def refresh(self, full=True):
+        dirs = {}
+        changed = 0
+        removed = 0
+        pending = [os.curdir]
+        while pending:
+            rel_dir = pending.pop()
+            try:
+                mtime = os.stat(os.path.join(self.dir, rel_dir)).st_mtime_ns
+            except OSError:
+                continue
+            known = self.dirs.get(rel_dir)
+            if known and known.mtime == mtime and not full:
+                dirs[rel_dir] = known
+            else:
+                dirs[rel_dir], dir_changed, dir_removed = self.scan(rel_dir, mtime, known)
+                changed += dir_changed
+                removed += dir_removed
+            pending.extend(dirs[rel_dir].subdirs)
+
+        for rel_dir in self.dirs.keys() - dirs.keys():
+            for key in self.dirs[rel_dir].keys:
+                if self.files.pop(key, None):
+                    removed += 1
+        self.dirs = dirs
+        self.resolved = {}
+        if full:
+            self.full_at = monotonic() + self.full_interval
+        if changed or removed:
+            self.missing = set()
+            logging.info(f"Index refreshed: {len(self.files)} paths, {changed} changed, {removed} removed")
+
+    def scan(self, rel_dir, mtime, known):
+        entries = {}
+        subdirs = []
+        changed = 0
+        with os.scandir(os.path.join(self.dir, rel_dir)) as items:
+            for item in items:
+                key = os.path.normpath(os.path.join(rel_dir, item.name))
+                try:
+                    if item.is_dir():
+                        if not item.is_symlink():
+                            subdirs.append(key)
+                        continue
+                    stat = item.stat()
+                except OSError:
+                    continue
+                entry = self.files.get(key)
+                if not entry or (entry.stat.st_mtime, entry.stat.st_size) != (stat.st_mtime, stat.st_size):
+                    entry = self.make_entry(os.path.join(self.dir, key), stat)
+                    changed += 1
+                entries[key] = entry
+                if item.name == INDEX_PATH:
+                    entries[rel_dir] = entry
+
+        self.files.update(entries)
+        removed = 0
+        for key in (known.keys if known else ()):
+            if key not in entries and self.files.pop(key, None):
+                removed += 1
+        return IndexDir(mtime, list(entries), subdirs), changed, removed
+
+    def lookup(self, url):
+        key = os.path.normpath(url[1:])
+        entry = self.files.get(key) or self.resolved.get(key)
+        if entry:
+            return entry
+        if os.path.isabs(key) or key == ".." or key.startswith("../") or key in self.missing:
+            return None
+
+        entry = self.resolve(key)
+        if entry:
+            self.resolved[key] = entry
+        else:
+            if len(self.missing) >= MISSING_CACHE_SIZE:
+                self.missing = set()
+            self.missing.add(key)
+        return entry
+
+    def discard(self, url):
+        key = os.path.normpath(url[1:])
+        self.files.pop(key, None)
+        self.resolved.pop(key, None)
+
+    def resolve(self, key):
+        path = os.path.join(self.dir, key)
+        if os.path.isdir(path):
+            path = os.path.join(path, INDEX_PATH)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return self.make_entry(path, stat)
+
+    def make_entry(self, path, stat):
+        return IndexEntry(path, stat, self.mime_types.lookup(path) if self.mime_types else None)
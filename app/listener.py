@@ -0,0 +1,75 @@
+import os
+import stat
+
+from socket import (AF_INET, AF_INET6, AF_UNIX, IPPROTO_IPV6, IPPROTO_TCP, IPV6_V6ONLY, SOCK_STREAM, SOL_SOCKET,
+                    SO_REUSEADDR, SO_REUSEPORT, TCP_NODELAY, socket)
+from const import LISTEN_BACKLOG
+
+try:
+    from socket import TCP_DEFER_ACCEPT, TCP_FASTOPEN
+except ImportError:
+    TCP_DEFER_ACCEPT = TCP_FASTOPEN = None
+
+
+class Listener:
+    def __init__(self, host="", port=8080, unix_path=None, backlog=LISTEN_BACKLOG, reuse_addr=True, reuse_port=False,
+                 nodelay=True, defer_accept=0, fastopen=0, v6_only=False):
+        self.host = host
+        self.port = port
+        self.unix_path = unix_path
+        self.backlog = backlog
+        self.reuse_addr = reuse_addr
+        self.reuse_port = reuse_port
+        self.nodelay = nodelay
+        self.defer_accept = defer_accept
+        self.fastopen = fastopen
+        self.v6_only = v6_only
+
+    def open(self):
+        if self.unix_path:
+            return self.open_unix()
+
+        family = AF_INET6 if ":" in self.host else AF_INET
+        s = socket(family, SOCK_STREAM)
+        try:
+            if self.reuse_addr:
+                s.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+            if self.reuse_port:
+                s.setsockopt(SOL_SOCKET, SO_REUSEPORT, 1)
+            if family == AF_INET6:
+                s.setsockopt(IPPROTO_IPV6, IPV6_V6ONLY, int(self.v6_only))
+            if self.defer_accept and TCP_DEFER_ACCEPT:
+                s.setsockopt(IPPROTO_TCP, TCP_DEFER_ACCEPT, self.defer_accept)
+            if self.fastopen and TCP_FASTOPEN:
+                s.setsockopt(IPPROTO_TCP, TCP_FASTOPEN, self.fastopen)
+            s.bind((self.host, self.port))
+            s.listen(self.backlog)
+        except OSError:
+            s.close()
+            raise
+        return s
+
+    def open_unix(self):
+        try:
+            if stat.S_ISSOCK(os.stat(self.unix_path).st_mode):
+                os.remove(self.unix_path)
+        except FileNotFoundError:
+            pass
+        s = socket(AF_UNIX, SOCK_STREAM)
+        try:
+            s.bind(self.unix_path)
+            s.listen(self.backlog)
+        except OSError:
+            s.close()
+            raise
+        return s
+
+    def prepare(self, connection):
+        if self.nodelay and connection.family != AF_UNIX:
+            connection.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+
+
+def peer_address(peername):
+    if isinstance(peername, tuple):
+        return peername[0]
+    return "-"
@@ -0,0 +1,127 @@
+from bisect import bisect_left
+from threading import Lock, local
+from time import perf_counter
+
+from const import LATENCY_BUCKETS
+
+
+class Shard:
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+
+
+def merge(total, shard):
+    for key, value in list(shard.counters.items()):
+        total.counters[key] = total.counters.get(key, 0) + value
+    for stage, histogram in list(shard.histograms.items()):
+        merged = total.histograms.setdefault(stage, [0] * len(histogram))
+        for i, value in enumerate(histogram):
+            merged[i] += value
+
+
+class Metrics:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.local = local()
+        self.shards = []
+        self.retired = Shard()
+        self.gauges = {}
+        self.lock = Lock()
+
+    def shard(self):
+        shard = getattr(self.local, "shard", None)
+        if shard is None:
+            shard = Shard()
+            with self.lock:
+                self.shards.append(shard)
+            self.local.shard = shard
+        return shard
+
+    def retire(self):
+        shard = getattr(self.local, "shard", None)
+        if shard is None:
+            return
+        with self.lock:
+            self.shards.remove(shard)
+            merge(self.retired, shard)
+        del self.local.shard
+
+    def inc(self, name, value=1, label=None):
+        counters = self.shard().counters
+        key = (name, label)
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, stage, seconds):
+        histograms = self.shard().histograms
+        histogram = histograms.get(stage)
+        if histogram is None:
+            histogram = histograms[stage] = [0] * (len(self.buckets) + 1) + [0.0]
+        histogram[bisect_left(self.buckets, seconds)] += 1
+        histogram[-1] += seconds
+
+    def record_response(self, status, sent, started, looked_up, serialized):
+        finished = perf_counter()
+        self.observe("lookup", looked_up - started)
+        self.observe("serialize", serialized - looked_up)
+        self.observe("send", finished - serialized)
+        self.inc("http_responses_total", label=("status", status))
+        self.inc("http_response_bytes_total", sent)
+
+    def record_error_response(self, status, sent):
+        self.inc("http_responses_total", label=("status", status))
+        self.inc("http_response_bytes_total", sent)
+
+    def record_proxy_response(self, status, sent, started):
+        self.observe("proxy", perf_counter() - started)
+        self.inc("http_responses_total", label=("status", status))
+        self.inc("http_response_bytes_total", sent)
+
+    def gauge(self, name, func, type="gauge"):
+        self.gauges[name] = (func, type)
+
+    def value(self, name, label=None):
+        with self.lock:
+            shards = self.shards + [self.retired]
+            return sum(shard.counters.get((name, label), 0) for shard in shards)
+
+    def render(self):
+        total = Shard()
+        with self.lock:
+            for shard in self.shards + [self.retired]:
+                merge(total, shard)
+        counters = total.counters
+        histograms = total.histograms
+
+        lines = []
+        typed = None
+        for (name, label), value in sorted(counters.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+            if name != typed:
+                lines.append(f"# TYPE {name} counter")
+                typed = name
+            lines.append(f"{name}{self.labels(label)} {value}")
+
+        name = "http_stage_seconds"
+        if histograms:
+            lines.append(f"# TYPE {name} histogram")
+        for stage, histogram in sorted(histograms.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, histogram):
+                cumulative += count
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            cumulative += histogram[len(self.buckets)]
+            lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {cumulative}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {histogram[-1]}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {cumulative}')
+
+        for name, (func, type) in sorted(self.gauges.items()):
+            lines.append(f"# TYPE {name} {type}")
+            lines.append(f"{name} {func()}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def labels(label):
+        if label is None:
+            return ""
+        name, value = label
+        return f'{{{name}="{value}"}}'
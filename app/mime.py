@@ -0,0 +1,52 @@
+from const import COMPRESSIBLE_TYPES, COMPRESSIBLE_SUFFIXES, DEFAULT_CONTENT_TYPE, MIME_TYPES
+
+
+class MimeType:
+    def __init__(self, type, cache_control=None):
+        self.type = type
+        self.compressible = type.startswith(COMPRESSIBLE_TYPES) or type.endswith(COMPRESSIBLE_SUFFIXES)
+        self.cache_control = cache_control
+
+
+class MimeRegistry:
+    def __init__(self, types=MIME_TYPES, default=DEFAULT_CONTENT_TYPE):
+        self.extensions = {}
+        self.types = {}
+        self.policies = {}
+        for ext, type in types.items():
+            self.add(ext, type)
+        self.default = self.get_type(default)
+
+    def load(self, path):
+        with open(path, encoding="utf8") as f:
+            for line in f:
+                fields = line.split("#", 1)[0].split()
+                for ext in fields[1:]:
+                    self.add(ext, fields[0])
+
+    def add(self, ext, type):
+        self.extensions[ext.lower().lstrip(".")] = self.get_type(type)
+
+    def set_policy(self, type, max_age):
+        self.policies[type] = max_age
+        for mime in self.types.values():
+            mime.cache_control = self.get_cache_control(mime.type)
+
+    def get_type(self, type):
+        mime = self.types.get(type)
+        if mime is None:
+            mime = self.types[type] = MimeType(type, self.get_cache_control(type))
+        return mime
+
+    def get_cache_control(self, type):
+        max_age = self.policies.get(type)
+        if max_age is None:
+            max_age = self.policies.get(type.split("/")[0] + "/*", self.policies.get("*"))
+        return f"public, max-age={max_age}" if max_age is not None else None
+
+    def lookup(self, path):
+        name = path.rpartition("/")[2]
+        _, dot, ext = name.rpartition(".")
+        if not dot:
+            return self.default
+        return self.extensions.get(ext.lower(), self.default)
@@ -0,0 +1,97 @@
+import logging
+
+from queue import Empty, SimpleQueue
+from threading import Lock, Thread
+from time import perf_counter
+from const import *
+
+
+class WorkerPool:
+    def __init__(self, min_threads, max_threads=POOL_MAX_WORKERS, idle_timeout=POOL_IDLE_TIMEOUT,
+                 grow_depth=POOL_GROW_DEPTH, grow_wait=POOL_GROW_WAIT, metrics=None):
+        self.min_threads = min_threads
+        self.max_threads = max(max_threads, min_threads)
+        self.idle_timeout = idle_timeout
+        self.grow_depth = grow_depth
+        self.grow_wait = grow_wait
+        self.metrics = metrics
+        self.tasks = SimpleQueue()
+        self.lock = Lock()
+        self.threads = 0
+        self.idle = 0
+        self.pending = 0
+        self.grown = 0
+        self.shrunk = 0
+        self.stopped = False
+
+    def start(self):
+        with self.lock:
+            for _ in range(self.min_threads):
+                self.spawn()
+
+    def submit(self, func, *args):
+        with self.lock:
+            self.pending += 1
+        self.tasks.put((func, args, perf_counter()))
+        self.grow("depth", self.grow_depth)
+
+    def grow(self, reason, backlog=1):
+        with self.lock:
+            if self.stopped or self.threads >= self.max_threads:
+                return
+            if self.pending - self.idle < backlog:
+                return
+            self.spawn()
+            self.grown += 1
+        logging.debug(f"Pool grew to {self.threads} threads on queue {reason}")
+
+    def spawn(self):
+        self.threads += 1
+        self.idle += 1
+        Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        while True:
+            try:
+                task = self.tasks.get(timeout=self.idle_timeout)
+            except Empty:
+                task = None
+            with self.lock:
+                if task is not None:
+                    self.pending -= 1
+                if self.stopped or (task is None and self.threads > self.min_threads):
+                    self.threads -= 1
+                    self.idle -= 1
+                    if not self.stopped:
+                        self.shrunk += 1
+                        logging.debug(f"Pool shrank to {self.threads} threads after idle")
+                    break
+                if task is None:
+                    continue
+                self.idle -= 1
+
+            func, args, queued = task
+            if perf_counter() - queued > self.grow_wait:
+                self.grow("wait")
+            try:
+                func(*args)
+            except Exception:
+                logging.exception("Pool task error:")
+            with self.lock:
+                self.idle += 1
+        if self.metrics:
+            self.metrics.retire()
+
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+
+    def stats(self):
+        with self.lock:
+            return {
+                "threads": self.threads,
+                "idle": self.idle,
+                "queued": self.tasks.qsize(),
+                "grown": self.grown,
+                "shrunk": self.shrunk,
+            }
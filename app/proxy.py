@@ -0,0 +1,318 @@
+import logging
+import posixpath
+
+from collections import deque
+from socket import AF_UNIX, IPPROTO_TCP, SOCK_STREAM, TCP_NODELAY, create_connection, socket, timeout
+from threading import BoundedSemaphore, Thread
+from time import monotonic, sleep
+from urllib.parse import unquote
+from const import *
+
+
+class ProxyError(Exception):
+    def __init__(self, status, info, reason):
+        super().__init__(info)
+        self.status = status
+        self.info = info
+        self.reason = reason
+
+
+class UpstreamReader:
+    def __init__(self, socket):
+        self.socket = socket
+        self.buffer = bytearray()
+        self.received = 0
+
+    def fill(self):
+        data = self.socket.recv(SOCKET_PART_SIZE)
+        self.received += len(data)
+        self.buffer += data
+        return len(data)
+
+    def read_until(self, delimiter, limit):
+        start = 0
+        while True:
+            end = self.buffer.find(delimiter, start)
+            if end >= 0:
+                end += len(delimiter)
+                data = bytes(self.buffer[:end])
+                del self.buffer[:end]
+                return data
+            if len(self.buffer) > limit:
+                raise ProxyError(BAD_GATEWAY, "Bad Gateway", "invalid_response")
+            start = max(len(self.buffer) - len(delimiter) + 1, 0)
+            if not self.fill():
+                raise ProxyError(BAD_GATEWAY, "Bad Gateway", "closed")
+
+    def read_some(self, size):
+        if not self.buffer and not self.fill():
+            return b""
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+
+class Upstream:
+    def __init__(self, address, pool_size=PROXY_POOL_SIZE, connect_timeout=PROXY_CONNECT_TIMEOUT,
+                 timeout=PROXY_TIMEOUT, health_path=None, health_interval=PROXY_HEALTH_INTERVAL,
+                 fail_timeout=PROXY_FAIL_TIMEOUT):
+        self.address = address
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+        self.health_path = health_path
+        self.health_interval = health_interval
+        self.fail_timeout = fail_timeout
+        self.idle = deque()
+        self.slots = BoundedSemaphore(pool_size)
+        self.healthy = True
+        self.down_until = 0
+
+    def start(self):
+        if self.health_path:
+            Thread(target=self.watch, daemon=True).start()
+
+    def available(self):
+        return self.healthy and monotonic() >= self.down_until
+
+    def connect(self):
+        if self.address.startswith("unix:"):
+            s = socket(AF_UNIX, SOCK_STREAM)
+            s.settimeout(self.connect_timeout)
+            try:
+                s.connect(self.address[5:])
+            except OSError:
+                s.close()
+                raise
+        else:
+            host, _, port = self.address.rpartition(":")
+            s = create_connection((host.strip("[]"), int(port)), self.connect_timeout)
+            s.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+        s.settimeout(self.timeout)
+        return s
+
+    def acquire(self, fresh=False):
+        if not self.slots.acquire(timeout=self.connect_timeout):
+            raise ProxyError(SERVICE_UNAVAILABLE, "Service Unavailable", "pool_exhausted")
+        if not fresh:
+            try:
+                return self.idle.pop(), True
+            except IndexError:
+                pass
+        try:
+            return self.connect(), False
+        except OSError:
+            self.slots.release()
+            self.down_until = monotonic() + self.fail_timeout
+            raise ProxyError(BAD_GATEWAY, "Bad Gateway", "connect")
+
+    def release(self, s, reusable):
+        if reusable:
+            self.idle.append(s)
+        else:
+            s.close()
+        self.slots.release()
+
+    def watch(self):
+        while True:
+            healthy = self.check()
+            if healthy != self.healthy:
+                logging.warning(f"Upstream {self.address} is {'up' if healthy else 'down'}")
+                self.healthy = healthy
+            sleep(self.health_interval)
+
+    def check(self):
+        try:
+            s = self.connect()
+        except OSError:
+            return False
+        try:
+            s.sendall(f"GET {self.health_path} HTTP/1.1\r\nHost: {self.address}\r\nConnection: close\r\n\r\n"
+                      .encode("utf-8"))
+            status_line = UpstreamReader(s).read_until(HTTP_STR_END, PROXY_MAX_HEAD)
+            return int(status_line.split()[1]) < 500
+        except (OSError, ProxyError, ValueError, IndexError):
+            return False
+        finally:
+            s.close()
+
+
+class Proxy:
+    def __init__(self, routes):
+        routes = [(prefix.rstrip("/"), upstream) for prefix, upstream in routes]
+        self.routes = sorted(routes, key=lambda route: len(route[0]), reverse=True)
+        self.upstreams = [upstream for _, upstream in self.routes]
+
+    def start(self):
+        for upstream in self.upstreams:
+            upstream.start()
+
+    def match(self, url):
+        path = posixpath.normpath(unquote(url.split("?")[0]))
+        for prefix, upstream in self.routes:
+            if path == prefix or path.startswith(prefix + "/"):
+                return upstream
+        return None
+
+    def forward(self, upstream, request, client, parser, keep_alive, peer, timeouts):
+        if "transfer-encoding" in request.headers:
+            raise ProxyError(LENGTH_REQUIRED, "Length Required", "chunked_request")
+        if not upstream.available():
+            raise ProxyError(SERVICE_UNAVAILABLE, "Service Unavailable", "upstream_down")
+        if request.version == HTTP_1_1 and request.headers.get("expect", "").lower() == "100-continue":
+            client.sendall(b"HTTP/1.1 100 Continue" + HTTP_END)
+
+        head = self.request_head(request, peer)
+        retry = not request.content_length
+        while True:
+            s, reused = upstream.acquire(fresh=not retry)
+            reader = UpstreamReader(s)
+            try:
+                s.sendall(head)
+                self.send_body(request, client, parser, s, timeouts)
+                version, status, headers = self.read_head(reader)
+                break
+            except timeout:
+                upstream.release(s, False)
+                raise ProxyError(GATEWAY_TIMEOUT, "Gateway Timeout", "timeout")
+            except (OSError, ProxyError) as e:
+                upstream.release(s, False)
+                if reused and retry and not reader.received:
+                    retry = False
+                    continue
+                if isinstance(e, ProxyError):
+                    raise
+                raise ProxyError(BAD_GATEWAY, "Bad Gateway", "upstream_error")
+
+        try:
+            framing, length, reusable = self.get_framing(request, version, status, headers)
+        except ProxyError:
+            upstream.release(s, False)
+            raise
+        if framing == PROXY_UNTIL_CLOSE or (framing == PROXY_CHUNKED and request.version != HTTP_1_1):
+            keep_alive = False
+        chunked = framing == PROXY_CHUNKED and request.version == HTTP_1_1
+
+        lines = [f"HTTP/1.1 {status}"]
+        for name, value in headers:
+            if name.lower() not in HOP_BY_HOP_HEADERS or (chunked and name.lower() == "transfer-encoding"):
+                lines.append(f"{name}: {value}")
+        lines.append("Connection: keep-alive" if keep_alive else "Connection: close")
+        response_head = HTTP_STR_END.join(line.encode("latin-1") for line in lines) + HTTP_END
+
+        sent = 0
+        try:
+            client.settimeout(timeouts.send)
+            client.sendall(response_head)
+            sent += len(response_head)
+            if framing == PROXY_LENGTH:
+                sent += self.copy(reader, client, length)
+            elif framing == PROXY_CHUNKED:
+                sent += self.copy_chunked(reader, client, chunked)
+            elif framing == PROXY_UNTIL_CLOSE:
+                sent += self.copy(reader, client, None)
+        except (OSError, ProxyError) as e:
+            upstream.release(s, False)
+            reason = e.reason if isinstance(e, ProxyError) else "aborted"
+            return int(status[:3]), sent, False, reason
+        upstream.release(s, reusable and not reader.buffer)
+        return int(status[:3]), sent, keep_alive, None
+
+    def request_head(self, request, peer):
+        target = request.raw_data.split(HTTP_STR_END, 1)[0].split()[1]
+        lines = [request.method.encode("latin-1") + b" " + target + b" HTTP/1.1"]
+        forwarded_for = peer
+        for name, value in request.headers.items():
+            if name == "x-forwarded-for":
+                forwarded_for = f"{value}, {peer}"
+            elif name not in HOP_BY_HOP_HEADERS and name != "expect":
+                lines.append(f"{name}: {value}".encode("latin-1"))
+        lines.append(f"x-forwarded-for: {forwarded_for}".encode("latin-1"))
+        lines.append(b"connection: keep-alive")
+        return HTTP_STR_END.join(lines) + HTTP_END
+
+    def send_body(self, request, client, parser, s, timeouts):
+        left = request.content_length
+        if not left:
+            return
+        data = parser.take(left)
+        if data:
+            s.sendall(data)
+            left -= len(data)
+        client.settimeout(timeouts.request)
+        while left:
+            data = client.recv(min(left, SOCKET_PART_SIZE))
+            if not data:
+                raise ProxyError(BAD_GATEWAY, "Bad Gateway", "client_closed")
+            s.sendall(data)
+            left -= len(data)
+
+    def read_head(self, reader):
+        while True:
+            head = reader.read_until(HTTP_END, PROXY_MAX_HEAD)
+            lines = head[:-len(HTTP_END)].decode("latin-1").split("\r\n")
+            version, _, status = lines[0].partition(" ")
+            if not version.startswith("HTTP/") or not status[:3].isdigit():
+                raise ProxyError(BAD_GATEWAY, "Bad Gateway", "invalid_response")
+            headers = []
+            for line in lines[1:]:
+                name, sep, value = line.partition(":")
+                if sep:
+                    headers.append((name.strip(), value.strip()))
+            if not status.startswith("1"):
+                return version, status, headers
+
+    def get_framing(self, request, version, status, headers):
+        values = {name.lower(): value.lower() for name, value in headers}
+        connection = [token.strip() for token in values.get("connection", "").split(",")]
+        reusable = "close" not in connection if version == HTTP_1_1 else "keep-alive" in connection
+
+        code = int(status[:3])
+        if request.method == "HEAD" or code in (204, NOT_MODIFIED):
+            return PROXY_NO_BODY, 0, reusable
+        if "chunked" in values.get("transfer-encoding", ""):
+            return PROXY_CHUNKED, None, reusable
+        if "content-length" in values:
+            if not values["content-length"].isdigit():
+                raise ProxyError(BAD_GATEWAY, "Bad Gateway", "invalid_response")
+            return PROXY_LENGTH, int(values["content-length"]), reusable
+        return PROXY_UNTIL_CLOSE, None, False
+
+    def copy(self, reader, client, length):
+        sent = 0
+        while length is None or sent < length:
+            size = SOCKET_PART_SIZE if length is None else min(length - sent, SOCKET_PART_SIZE)
+            data = reader.read_some(size)
+            if not data:
+                if length is None:
+                    break
+                raise ProxyError(BAD_GATEWAY, "Bad Gateway", "truncated")
+            client.sendall(data)
+            sent += len(data)
+        return sent
+
+    def copy_chunked(self, reader, client, chunked):
+        sent = 0
+        while True:
+            line = reader.read_until(HTTP_STR_END, PROXY_MAX_HEAD)
+            try:
+                size = int(line.split(b";")[0].strip(), 16)
+            except ValueError:
+                raise ProxyError(BAD_GATEWAY, "Bad Gateway", "invalid_response")
+            if chunked:
+                client.sendall(line)
+                sent += len(line)
+            if not size:
+                break
+            sent += self.copy(reader, client, size)
+            line = reader.read_until(HTTP_STR_END, PROXY_MAX_HEAD)
+            if chunked:
+                client.sendall(line)
+                sent += len(line)
+
+        while True:
+            line = reader.read_until(HTTP_STR_END, PROXY_MAX_HEAD)
+            if chunked:
+                client.sendall(line)
+                sent += len(line)
+            if line == HTTP_STR_END:
+                return sent
@@ -1,28 +1,119 @@
-from const import UNKNOWN
+import re
+
+from const import *
+
+HEADER_NAME = re.compile(rb"[!#$%&'*+\-.^_`|~0-9A-Za-z]+\Z")
+HEADER_VALUE_INVALID = re.compile(rb"[\r\n\x00]")
+
+
+class RequestError(ValueError):
+    def __init__(self, status, info):
+        super().__init__(info)
+        self.status = status
+        self.info = info
+
+
+class RequestParser:
+    def __init__(self, max_size=MAX_REQUEST_SIZE, max_headers=MAX_HEADERS, keep_body=None):
+        self.buffer = bytearray()
+        self.scanned = 0
+        self.body_left = 0
+        self.max_size = max_size
+        self.max_headers = max_headers
+        self.keep_body = keep_body
+
+    def feed(self, data):
+        if self.body_left:
+            skip = min(self.body_left, len(data))
+            self.body_left -= skip
+            data = data[skip:]
+        self.buffer += data
+
+    def parse(self):
+        while self.buffer[:2] == HTTP_STR_END:
+            del self.buffer[:2]
+
+        end = self.buffer.find(HTTP_END, self.scanned)
+        if end < 0:
+            if len(self.buffer) > self.max_size:
+                raise RequestError(HEADER_FIELDS_TOO_LARGE, "Request Header Fields Too Large")
+            self.scanned = max(len(self.buffer) - len(HTTP_END) + 1, 0)
+            return None
+        if end > self.max_size:
+            raise RequestError(HEADER_FIELDS_TOO_LARGE, "Request Header Fields Too Large")
+
+        with memoryview(self.buffer) as view:
+            request = Request(view[:end].tobytes(), self.max_headers)
+        del self.buffer[:end + len(HTTP_END)]
+        self.scanned = 0
+        if not (self.keep_body and self.keep_body(request.url)):
+            if "transfer-encoding" in request.headers:
+                raise RequestError(LENGTH_REQUIRED, "Length Required")
+            self.skip(request.content_length)
+        return request
+
+    def take(self, length):
+        data = bytes(self.buffer[:length])
+        del self.buffer[:length]
+        return data
+
+    def skip(self, length):
+        skip = min(length, len(self.buffer))
+        del self.buffer[:skip]
+        self.body_left = length - skip
 
 
 class Request():
-    def __init__(self, raw_data):
+    def __init__(self, raw_data, max_headers=MAX_HEADERS):
         self.raw_data = raw_data
+        self.max_headers = max_headers
         self.parsed = False
         # self._url = ""
         # self._method = ""
         self.parse_data()
 
     def parse_data(self):
-        splited_data = self.raw_data.split()
+        lines = self.raw_data.split(HTTP_STR_END)
+        if len(lines) - 1 > self.max_headers:
+            raise RequestError(HEADER_FIELDS_TOO_LARGE, "Too many request header fields")
+
+        if HEADER_VALUE_INVALID.search(lines[0]):
+            raise RequestError(BAD_REQUEST, "Bad Request")
+        splited_data = lines[0].split()
         if len(splited_data) < 2:
             method = UNKNOWN
             url = UNKNOWN
         else:
-            method = splited_data[0]
-            url = splited_data[1]
+            method = splited_data[0].decode("latin-1")
+            url = splited_data[1].decode("utf8", errors="replace")
+        version = splited_data[2].decode("latin-1") if len(splited_data) > 2 else HTTP_1_0
+
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(b":")
+            if not sep or not HEADER_NAME.match(name) or HEADER_VALUE_INVALID.search(value):
+                raise RequestError(BAD_REQUEST, "Bad Request")
+            headers[name.lower().decode("latin-1")] = value.strip().decode("latin-1")
 
         self.method = method
         self.url = url
+        self.version = version
+        self.headers = headers
+
+        content_length = headers.get("content-length", "0").strip()
+        if not (content_length.isascii() and content_length.isdigit()):
+            raise RequestError(BAD_REQUEST, "Bad Request")
+        self.content_length = int(content_length)
 
         self.parsed = True
 
+    @property
+    def keep_alive(self):
+        connection = [t.strip() for t in self.headers.get("connection", "").lower().split(",")]
+        if self.version == HTTP_1_1:
+            return "close" not in connection
+        return "keep-alive" in connection
+
     @property
     def url(self):
         # if not self.parsed:
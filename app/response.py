@@ -1,44 +1,227 @@
+from email.utils import parsedate_to_datetime
+from gzip import compress as gzip_compress
 from urllib.parse import unquote
-import datetime
+from uuid import uuid4
+import asyncio
+import errno
+import logging
 import os
-from time import mktime
+import resource
+import sys
+from mmap import mmap, ACCESS_READ
+from time import monotonic, perf_counter, time
+from threading import Event, Lock
 from wsgiref.handlers import format_date_time
 from const import *
 from collections import OrderedDict
+from mime import MimeRegistry
+
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+compressors = {"gzip": gzip_compress}
+if brotli:
+    compressors["br"] = brotli.compress
+
+mmap_options = {"trackfd": False} if sys.version_info >= (3, 13) else {}
+
+
+class Flight:
+    def __init__(self):
+        self.done = Event()
+        self.content = None
+        self.error = None
 
 
 class CacheContent:
-    def __init__(self, cache_time=1):
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL, max_entries=None, use_mmap=False):
         self.cache = OrderedDict()
-        self.add_times = []
-        self.cache_time = cache_time
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.use_mmap = use_mmap
+        if use_mmap:
+            self.max_entries = self.limit_mappings(max_entries)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+        self.flights = {}
+        self.lock = Lock()
 
     def add(self, key, content):
-        self.cache[key] = content
-        self.add_times.append(datetime.datetime.now())
+        size = content.content_len or 0
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.cache:
+                self._remove(key)
+            self.cache[key] = (content, size, monotonic() + self.ttl)
+            self.size += size
+            while self.size > self.max_bytes or (self.max_entries and len(self.cache) > self.max_entries):
+                self._remove(next(iter(self.cache)))
+                self.evictions += 1
+
+    def load(self, key, loader):
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error:
+                raise flight.error
+            return flight.content
+
+        try:
+            flight.content = loader()
+            self.add(key, flight.content)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+        return flight.content
+
+    def limit_mappings(self, max_entries):
+        soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft == resource.RLIM_INFINITY:
+            return max_entries
+        fds = 1 if mmap_options else 2
+        limit = max(int(soft * MMAP_FD_SHARE) // fds, 1)
+        if max_entries is None or max_entries > limit:
+            logging.warning(f"Limiting mappings to {limit}, open files limit is {soft}")
+            return limit
+        return max_entries
+
+    def read(self, f, size):
+        if self.use_mmap and size:
+            return memoryview(mmap(f.fileno(), 0, access=ACCESS_READ, **mmap_options))
+        return f.read()
 
     def get(self, key):
-        if key in self.cache:
-            return self.cache[key]
-        return None
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is None:
+                return None
+            content, size, expires = entry
+            if expires <= monotonic():
+                self._remove(key)
+                return None
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return content
+
+    def remove(self, key):
+        with self.lock:
+            if key in self.cache:
+                self._remove(key)
 
     def clear(self):
-        while self.add_times:
-            add_date = self.add_times[0]
-            if add_date + datetime.timedelta(minutes=self.cache_time) > datetime.datetime.now():
-                break
+        now = monotonic()
+        with self.lock:
+            expired = [key for key, (_, _, expires) in self.cache.items() if expires <= now]
+            for key in expired:
+                self._remove(key)
+
+    def keys(self):
+        with self.lock:
+            return list(reversed(self.cache))
+
+    def purge(self):
+        with self.lock:
+            for key in list(self.cache):
+                self._remove(key)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.cache),
+                "bytes": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "coalesced": self.coalesced,
+            }
+
+    def _remove(self, key):
+        _, size, _ = self.cache.pop(key)
+        self.size -= size
+
+
+def make_etag(mtime, size, encoding=None):
+    if encoding:
+        return f'"{int(mtime * 1000000):x}-{size:x}-{encoding}"'
+    return f'"{int(mtime * 1000000):x}-{size:x}"'
+
+
+def parse_ranges(value, size):
+    unit, _, specs = value.partition("=")
+    if unit.strip().lower() != "bytes":
+        return None
 
-            self.cache.popitem(last=False)
-            self.add_times.pop(0)
+    ranges = []
+    for spec in specs.split(","):
+        start, sep, end = spec.strip().partition("-")
+        if not sep:
+            return None
+        try:
+            if start:
+                start = int(start)
+                if end:
+                    end = int(end)
+                    if end < start:
+                        return None
+                    end = min(end, size - 1)
+                else:
+                    end = size - 1
+            else:
+                length = int(end)
+                start = max(size - length, 0)
+                end = size - 1 if length > 0 else -1
+        except ValueError:
+            return None
+        if start <= end:
+            ranges.append((start, end))
+
+    if len(ranges) > MAX_RANGES:
+        return None
+    return ranges
 
 
 class Content:
-    def __init__(self, content, ext, len, status, info):
+    def __init__(self, content, mime, len, status, info, path=None, mtime=None, stream=False):
         self.content = content
-        self.content_ext = ext
+        self.mime = mime
         self.content_len = len
         self.content_status = status
         self.content_info = info
+        self.content_path = path
+        self.content_mtime = mtime
+        self.stream = stream
+        self.segments = [(b"", 0, len)] if stream else []
+        self.extra_headers = {}
+        self.encoding = None
+        self.source_path = path
+        self.mapped_file = None
+        self.etag = make_etag(mtime, len) if mtime is not None and len is not None else None
+
+    def is_intact(self):
+        if self.mapped_file is None:
+            return True
+        stat = os.fstat(self.mapped_file.fileno())
+        return stat.st_size == self.content_len and stat.st_mtime == self.content_mtime
 
     @classmethod
     def not_allowed(cls, method):
@@ -50,42 +233,137 @@ class Content:
         obj = cls(None, None, None, FORBIDDEN, f"Forbidden – you don’t have permission to access {url}")
         return obj
 
+    @classmethod
+    def error(cls, status, info):
+        obj = cls(None, None, None, status, info)
+        return obj
+
     @classmethod
     def not_found(cls, url):
         obj = cls(None, None, None, NOT_FOUND, f"{url} not found")
         return obj
 
     @classmethod
-    def ok(cls, content, path):
-        obj = cls(content, path.split(".")[-1], os.path.getsize(path), OK, "OK")
+    def ok(cls, content, path, stat, mime):
+        obj = cls(content, mime, stat.st_size, OK, "OK", path, stat.st_mtime)
+        return obj
+
+    @classmethod
+    def not_modified(cls, content):
+        obj = cls(None, content.mime, content.content_len, NOT_MODIFIED, "Not Modified",
+                  content.content_path, content.content_mtime)
+        obj.etag = content.etag
+        obj.encoding = content.encoding
         return obj
 
+    @classmethod
+    def head(cls, content):
+        obj = cls(None, content.mime, content.content_len, content.content_status, content.content_info,
+                  content.content_path, content.content_mtime)
+        obj.etag = content.etag
+        obj.encoding = content.encoding
+        return obj
 
-class Response:
-    content_types = {
-        "jpg": "image/jpeg",
-        "jpeg": "image/jpeg",
-        "png": "image/png",
-        "gif": "image/gif",
+    @classmethod
+    def encoded(cls, content, path, stat, mime, encoding, len, source_path=None, stream=False):
+        obj = cls(content, mime, len, OK, "OK", path, stat.st_mtime, stream=stream)
+        obj.encoding = encoding
+        obj.source_path = source_path or path
+        obj.etag = make_etag(stat.st_mtime, stat.st_size, encoding)
+        return obj
 
-        "css": "text/css",
-        "html": "text/html",
+    @classmethod
+    def file(cls, path, stat, mime):
+        obj = cls(None, mime, stat.st_size, OK, "OK", path, stat.st_mtime, stream=True)
+        return obj
+
+    @classmethod
+    def partial(cls, path, stat, mime, len, segments, headers):
+        obj = cls(None, mime, len, PARTIAL_CONTENT, "Partial Content", path, stat.st_mtime, stream=True)
+        obj.segments = segments
+        obj.extra_headers = headers
+        obj.etag = make_etag(stat.st_mtime, stat.st_size)
+        return obj
+
+    @classmethod
+    def range_not_satisfiable(cls, size):
+        obj = cls(None, None, None, RANGE_NOT_SATISFIABLE, "Range Not Satisfiable")
+        obj.extra_headers = {"Content-Range": f"bytes */{size}"}
+        return obj
+
+
+def time_left(deadline):
+    left = deadline - perf_counter()
+    if left <= 0:
+        raise TimeoutError("Deadline exceeded")
+    return left
+
+
+def send_buffers(socket, buffers, wait):
+    buffers = [memoryview(buffer) for buffer in buffers if len(buffer)]
+    while buffers:
+        wait()
+        sent = socket.sendmsg(buffers)
+        while sent:
+            if sent >= len(buffers[0]):
+                sent -= len(buffers.pop(0))
+            else:
+                buffers[0] = buffers[0][sent:]
+                sent = 0
+
+
+class DateClock:
+    def __init__(self):
+        self.cached = (None, b"")
+
+    def now(self):
+        second = int(time())
+        cached_second, date = self.cached
+        if second != cached_second:
+            date = format_date_time(second).encode("utf-8")
+            self.cached = (second, date)
+        return date
 
-        "js": "application/javascript",
-        "swf": "application/x-shockwave-flash",
-    }
 
-    UNKNOWN_CONTENT = "unknown"
+date_clock = DateClock()
+
+
+class Response:
+    mime_types = MimeRegistry()
+
+    encodings = {
+        "br": ".br",
+        "gzip": ".gz",
+    }
 
     methods = ("GET", "HEAD")
 
+    sendfile_min_size = SENDFILE_MIN_SIZE
+
+    head_cache = OrderedDict()
+
     @classmethod
-    def get_response(cls, request, dir, cache):
-        response = cls(request.url, request.method, dir, cache)
+    def get_response(cls, request, dir, cache, keep_alive=False, index=None):
+        response = cls(request.url, request.method, dir, cache, keep_alive, request.headers, index)
         response.load_content()
         return response
 
-    def __init__(self, url, method, dir, cache=None):
+    @classmethod
+    def get_error_response(cls, status, info, headers=None):
+        response = cls("", UNKNOWN, None)
+        response.content = Content.error(status, info)
+        response.content.extra_headers = headers or {}
+        return response
+
+    @classmethod
+    def get_text_response(cls, text, content_type, keep_alive=False):
+        response = cls("", UNKNOWN, None, keep_alive=keep_alive)
+        data = text.encode("utf-8")
+        response.content = Content(data, None, len(data), OK, "OK")
+        response.content.extra_headers = {"Content-Type": content_type}
+        return response
+
+    def __init__(self, url, method, dir, cache=None, keep_alive=False, headers=None, index=None):
         url = unquote(url)
         url = url.split("?")[0]
         self.url = url
@@ -94,26 +372,35 @@ class Response:
         self.content = None
         self.code = 0
         self.cache = cache
+        self.keep_alive = keep_alive
+        self.request_headers = headers or {}
+        self.index = index
+        self.stat = None
+        self.mime = None
 
     @property
     def headers(self):
-
-        now = datetime.datetime.now()
-        stamp = mktime(now.timetuple())
-
         headers = {
-            "Date": format_date_time(stamp),
             "Server": SERVER_NAME,
-            "Connection": "close"
         }
-
-        content_length = self.get_content_length()
-        if content_length:
-            headers["Content-Length"] = content_length
+        if self.content.content_status != NOT_MODIFIED:
+            headers["Content-Length"] = self.get_content_length()
+        if self.content.content_status == OK and self.content.content_path and not self.content.encoding:
+            headers["Accept-Ranges"] = "bytes"
+        if self.content.encoding:
+            headers["Content-Encoding"] = self.content.encoding
+        if self.content.content_path and self.content.mime and self.content.mime.compressible:
+            headers["Vary"] = "Accept-Encoding"
+        if self.content.mime and self.content.mime.cache_control and self.content.content_status in CACHEABLE:
+            headers["Cache-Control"] = self.content.mime.cache_control
+        if self.content.etag:
+            headers["Last-Modified"] = format_date_time(self.content.content_mtime)
+            headers["ETag"] = self.content.etag
 
         content_type = self.get_content_type()
         if content_type:
             headers["Content-Type"] = content_type
+        headers.update(self.content.extra_headers)
 
         return headers
 
@@ -132,27 +419,192 @@ class Response:
         return path
 
     def load_content(self):
-        path = self.get_content_path()
+        if self.index:
+            entry = self.index.lookup(self.url)
+            path = entry.path if entry else None
+            self.stat = entry.stat if entry else None
+            self.mime = entry.mime if entry else None
+        else:
+            path = self.get_content_path()
         if path:
             self.content = self.get_content_by_path(path)
         else:
             self.content = self.not_found_processor()
 
-    def get_processor(self, path):
+    def is_not_modified(self, etag, mtime):
+        if_none_match = self.request_headers.get("if-none-match")
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            return "*" in tags or etag in tags or "W/" + etag in tags
+
+        if_modified_since = self.request_headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(mtime) <= since
+        return False
+
+    def range_processor(self, path, stat, mime, value):
+        if_range = self.request_headers.get("if-range")
+        if if_range and if_range not in (make_etag(stat.st_mtime, stat.st_size), format_date_time(stat.st_mtime)):
+            return None
+
+        size = stat.st_size
+        ranges = parse_ranges(value, size)
+        if ranges is None:
+            return None
+        if not ranges:
+            return Content.range_not_satisfiable(size)
+
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            headers = {"Content-Range": f"bytes {start}-{end}/{size}"}
+            return Content.partial(path, stat, mime, end - start + 1, [(b"", start, end - start + 1)], headers)
+
+        boundary = uuid4().hex
+        content_type = mime.type
+        segments = []
+        for start, end in ranges:
+            delimiter = "\r\n" if segments else ""
+            part = (f"{delimiter}--{boundary}\r\nContent-Type: {content_type}\r\n"
+                    f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n")
+            segments.append((part.encode("utf-8"), start, end - start + 1))
+        segments.append((f"\r\n--{boundary}--\r\n".encode("utf-8"), 0, 0))
+
+        length = sum(len(part) + count for part, _, count in segments)
+        headers = {"Content-Type": f"multipart/byteranges; boundary={boundary}"}
+        return Content.partial(path, stat, mime, length, segments, headers)
+
+    def get_encodings(self, mime):
+        if not mime.compressible:
+            return []
+
+        accepted = {}
+        for item in self.request_headers.get("accept-encoding", "").split(","):
+            coding, _, params = item.partition(";")
+            params = params.strip()
+            try:
+                q = float(params[2:]) if params.startswith("q=") else 1.0
+            except ValueError:
+                q = 0.0
+            accepted[coding.strip().lower()] = q
+        qualities = {e: accepted.get(e, accepted.get("*", 0)) for e in self.encodings}
+        return sorted((e for e in self.encodings if qualities[e] > 0), key=lambda e: -qualities[e])
+
+    def is_fresh(self, content):
+        if self.stat and content.content_mtime != self.stat.st_mtime:
+            return False
+        if not content.is_intact():
+            self.cache.remove(content.content_path)
+            return False
+        return True
+
+    def validate(self, content):
+        if self.is_not_modified(content.etag, content.content_mtime):
+            return Content.not_modified(content)
+        return content
+
+    def encoded_processor(self, path, mime, encoding):
+        key = (path, encoding)
         if self.cache:
+            content = self.cache.get(key)
+            if content and self.is_fresh(content):
+                return self.validate(content)
+
+        stat = self.get_stat(path)
+        sibling = path + self.encodings[encoding]
+        try:
+            sibling_stat = os.stat(sibling)
+        except OSError:
+            sibling_stat = None
+
+        if sibling_stat and sibling_stat.st_mtime >= stat.st_mtime:
+            stream = sibling_stat.st_size >= self.sendfile_min_size
+            content = self.validate(Content.encoded(None, path, stat, mime, encoding, sibling_stat.st_size, sibling,
+                                                    stream=stream))
+            if stream or content.content_status == NOT_MODIFIED:
+                return content
+            source, compress = sibling, None
+        elif encoding in compressors and COMPRESS_MIN_SIZE <= stat.st_size <= COMPRESS_MAX_SIZE:
+            content = self.validate(Content.encoded(None, path, stat, mime, encoding, None))
+            if content.content_status == NOT_MODIFIED:
+                return content
+            source, compress = path, compressors[encoding]
+        else:
+            return None
+
+        def load():
+            with open(source, mode="rb") as f:
+                data = f.read()
+            if compress:
+                data = compress(data)
+            return Content.encoded(data, path, stat, mime, encoding, len(data))
+
+        return self.load_once(key, load)
+
+    def get_processor(self, path):
+        mime = self.get_mime(path)
+        range_header = self.request_headers.get("range")
+        if not range_header:
+            for encoding in self.get_encodings(mime):
+                content = self.encoded_processor(path, mime, encoding)
+                if content:
+                    return content
+
+        if self.cache and not range_header and not (self.stat and self.stat.st_size >= self.sendfile_min_size):
             content = self.cache.get(path)
+            if content and self.is_fresh(content):
+                return self.validate(content)
+
+        stat = self.get_stat(path)
+        if self.stat and stat.st_size >= self.sendfile_min_size:
+            stat = os.stat(path)
+        content = Content.ok(None, path, stat, mime)
+        if self.is_not_modified(content.etag, content.content_mtime):
+            return Content.not_modified(content)
+        if range_header:
+            content = self.range_processor(path, stat, mime, range_header)
             if content:
                 return content
+        if stat.st_size >= self.sendfile_min_size:
+            return Content.file(path, stat, mime)
+
+        def load():
+            f = open(path, mode="rb")
+            try:
+                stat = os.fstat(f.fileno())
+                data = self.cache.read(f, stat.st_size) if self.cache else f.read()
+                content = Content.ok(data, path, stat, mime)
+                if isinstance(data, memoryview):
+                    content.mapped_file, f = f, None
+                return content
+            finally:
+                if f:
+                    f.close()
 
-        with open(path, mode="rb") as f:
-            content = Content.ok(f.read(), path)
-            if self.cache:
-                self.cache.add(path, content)
-            return content
+        return self.load_once(path, load)
+
+    def load_once(self, key, loader):
+        if self.cache:
+            return self.cache.load(key, loader)
+        return loader()
 
     def head_processor(self, path):
-        content = Content.ok(None, path)
-        return content
+        mime = self.get_mime(path)
+        for encoding in self.get_encodings(mime):
+            content = self.encoded_processor(path, mime, encoding)
+            if content:
+                return Content.head(content)
+        content = Content.ok(None, path, self.get_stat(path), mime)
+        return self.validate(content)
+
+    def get_stat(self, path):
+        return self.stat or os.stat(path)
+
+    def get_mime(self, path):
+        return self.mime or self.mime_types.lookup(path)
 
     def not_allowed_processor(self):
         return Content.not_allowed(self.method)
@@ -168,6 +620,10 @@ class Response:
                 return self.head_processor(path)
             return self.not_allowed_processor()
 
+        except FileNotFoundError:
+            if self.index:
+                self.index.discard(self.url)
+            return self.not_found_processor()
         except Exception:
             return Content.forbidden(self.url)
 
@@ -175,23 +631,107 @@ class Response:
         return self.content.content_len or 0
 
     def get_content_type(self):
-        if self.content.content_ext and self.content.content_ext in self.content_types:
-            return self.content_types[self.content.content_ext]
-        return self.UNKNOWN_CONTENT
+        if self.content.mime:
+            return self.content.mime.type
+        return None
 
     def get_code(self):
         return self.content.content_status, self.content.content_info
 
-    def to_binary(self):
+    def get_head(self):
+        path = self.content.content_path
+        key = (path, self.content.content_status, self.content.encoding)
+        version = (self.content.content_mtime, self.content.content_len)
+        if path and not self.content.extra_headers:
+            cached = self.head_cache.get(key)
+            if cached and cached[0] == version:
+                try:
+                    self.head_cache.move_to_end(key)
+                except KeyError:
+                    pass
+                return cached[1]
+
         code, info = self.get_code()
 
         text = []
         text.append(f"HTTP/1.1 {str(code)} {info}")
         for k, v in self.headers.items():
             text.append((k + ": " + str(v)))
+        text.append("Date: ")
+
+        text = [t.encode("utf-8") for t in text]
+
+        head = HTTP_STR_END.join(text)
+        if path and not self.content.extra_headers:
+            self.head_cache[key] = (version, head)
+            if len(self.head_cache) > HEAD_CACHE_SIZE:
+                try:
+                    self.head_cache.popitem(last=False)
+                except KeyError:
+                    pass
+        return head
+
+    def head_to_binary(self):
+        connection = CONNECTION_KEEP_ALIVE if self.keep_alive else CONNECTION_CLOSE
+        return self.get_head() + date_clock.now() + connection
+
+    def buffers(self, head=None):
+        head = head or self.head_to_binary()
         if self.content.content:
-            text.append(HTTP_STR_END + self.content.content)
+            return [head, memoryview(self.content.content)]
+        return [head]
 
-        text = [t.encode("utf-8") if isinstance(t, str) else t for t in text]
-
-        return HTTP_STR_END.join(text) + HTTP_END
+    def body_length(self):
+        if self.content.content:
+            return len(self.content.content)
+        return sum(len(part) + count for part, _, count in self.content.segments)
+
+    def send(self, socket, head=None, deadline=None, stall_timeout=None):
+        def wait():
+            if deadline:
+                left = time_left(deadline)
+                socket.settimeout(min(left, stall_timeout) if stall_timeout else left)
+
+        head = head or self.head_to_binary()
+        buffers = self.buffers(head)
+        if self.content.mapped_file:
+            try:
+                send_buffers(socket, buffers, wait)
+            except OSError as e:
+                if e.errno == errno.EFAULT and self.cache:
+                    self.cache.remove(self.content.content_path)
+                raise
+            return len(head) + self.body_length()
+        if self.content.stream:
+            with open(self.content.source_path, mode="rb") as f:
+                for part, offset, count in self.content.segments:
+                    buffers.append(part)
+                    if count:
+                        send_buffers(socket, buffers, wait)
+                        buffers = []
+                        for start in range(offset, offset + count, SENDFILE_SLICE_SIZE):
+                            wait()
+                            size = min(SENDFILE_SLICE_SIZE, offset + count - start)
+                            if socket.sendfile(f, start, size) < size:
+                                raise EOFError(f"{self.content.source_path} was truncated while sending")
+        send_buffers(socket, buffers, wait)
+        return len(head) + self.body_length()
+
+    async def send_async(self, writer, head=None, deadline=None):
+        def wait(awaitable):
+            return asyncio.wait_for(awaitable, time_left(deadline) if deadline else None)
+
+        head = head or self.head_to_binary()
+        writer.writelines(self.buffers(head))
+        if self.content.stream:
+            loop = asyncio.get_running_loop()
+            with open(self.content.source_path, mode="rb") as f:
+                for part, offset, count in self.content.segments:
+                    if part:
+                        writer.write(part)
+                    if count:
+                        await wait(writer.drain())
+                        if await wait(loop.sendfile(writer.transport, f, offset, count)) < count:
+                            raise EOFError(f"{self.content.source_path} was truncated while sending")
+        await wait(writer.drain())
+        return len(head) + self.body_length()
@@ -0,0 +1,153 @@
+import logging
+import os
+import signal
+import sys
+
+from select import select
+from socket import socket
+from time import monotonic, sleep
+from const import LISTEN_FD_ENV, READY_TIMEOUT, RESPAWN_DELAY, RETIRED_PIDS_ENV
+
+SIGNALS = {signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGUSR2}
+
+
+class Supervisor:
+    def __init__(self, server, processes):
+        self.server = server
+        self.processes = processes
+        self.children = {}
+        self.ready_fds = {}
+        self.retired = set()
+        self.stopping = False
+
+    def run(self):
+        self.server.get_root_dir()
+        fd = os.environ.pop(LISTEN_FD_ENV, None)
+        if fd:
+            self.server.socket = socket(fileno=int(fd))
+        elif not self.server.reuse_port:
+            self.server.listen()
+
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGHUP, self.reload)
+        signal.signal(signal.SIGUSR2, self.upgrade)
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, SIGNALS)
+
+        pids = [self.spawn() for _ in range(self.processes)]
+        ready = self.wait_ready(pids)
+        logging.info(f"Supervisor started {ready} of {self.processes} processes")
+        retired = [int(pid) for pid in os.environ.pop(RETIRED_PIDS_ENV, "").split(",") if pid]
+        if ready or not retired:
+            self.retire(retired)
+        else:
+            self.retire(pids)
+            self.children.update((pid, monotonic()) for pid in retired)
+            logging.error("Supervisor upgrade failed, keeping the old processes")
+
+        while self.children or self.retired:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            self.retired.discard(pid)
+            started = self.children.pop(pid, None)
+            if started is None or self.stopping:
+                continue
+            logging.warning(f"Process {pid} exited with status {status}, restarting")
+            if monotonic() - started < RESPAWN_DELAY:
+                sleep(RESPAWN_DELAY)
+            if not self.stopping:
+                self.wait_ready([self.spawn()], timeout=0)
+        logging.info("Supervisor stopped")
+
+    def spawn(self):
+        ready_fd, notify_fd = os.pipe()
+        pid = os.fork()
+        if pid:
+            os.close(notify_fd)
+            self.children[pid] = monotonic()
+            self.ready_fds[pid] = ready_fd
+            return pid
+
+        os.close(ready_fd)
+        for fd in self.ready_fds.values():
+            os.close(fd)
+        self.server.on_ready = lambda: self.notify(notify_fd)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        signal.signal(signal.SIGHUP, signal.SIG_DFL)
+        signal.signal(signal.SIGUSR2, signal.SIG_DFL)
+        code = 0
+        try:
+            self.server.run()
+        except KeyboardInterrupt:
+            self.server.stop()
+        except Exception:
+            logging.exception("An error occurred:")
+            code = 1
+        finally:
+            os._exit(code)
+
+    def notify(self, fd):
+        try:
+            os.write(fd, b"1")
+        except OSError:
+            pass
+        os.close(fd)
+
+    def wait_ready(self, pids, timeout=READY_TIMEOUT):
+        fds = {self.ready_fds.pop(pid): pid for pid in pids if pid in self.ready_fds}
+        deadline = monotonic() + timeout
+        ready = 0
+        while fds:
+            left = deadline - monotonic()
+            if left <= 0:
+                break
+            readable, _, _ = select(list(fds), [], [], left)
+            for fd in readable:
+                if os.read(fd, 1):
+                    ready += 1
+                else:
+                    logging.warning(f"Process {fds[fd]} exited before it was ready")
+                os.close(fd)
+                del fds[fd]
+        for fd, pid in fds.items():
+            if timeout:
+                logging.warning(f"Process {pid} is not ready after {timeout}s")
+            os.close(fd)
+        return ready
+
+    def retire(self, pids):
+        for pid in pids:
+            self.children.pop(pid, None)
+            self.retired.add(pid)
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                self.retired.discard(pid)
+
+    def reload(self, signum, frame):
+        previous = list(self.children)
+        pids = [self.spawn() for _ in range(self.processes)]
+        if not self.wait_ready(pids):
+            self.retire(pids)
+            logging.error("Supervisor reload failed, keeping the old processes")
+            return
+        self.retire(previous)
+        logging.info(f"Supervisor reloaded, draining {len(previous)} processes")
+
+    def upgrade(self, signum, frame):
+        if self.server.socket:
+            fd = self.server.socket.fileno()
+            os.set_inheritable(fd, True)
+            os.environ[LISTEN_FD_ENV] = str(fd)
+        os.environ[RETIRED_PIDS_ENV] = ",".join(str(pid) for pid in list(self.children) + list(self.retired))
+        logging.info("Supervisor upgrading")
+        # the mask survives execv, signals wait until the new supervisor has its handlers
+        signal.pthread_sigmask(signal.SIG_BLOCK, SIGNALS)
+        os.execv(sys.executable, [sys.executable] + sys.argv)
+
+    def stop(self, signum, frame):
+        self.stopping = True
+        self.retire(list(self.children))
@@ -0,0 +1,89 @@
+import logging
+import os
+
+from multiprocessing.dummy import Pool as ThreadPool
+from time import perf_counter
+from urllib.parse import quote, unquote
+from const import *
+from response import Response
+
+
+class Warmup:
+    def __init__(self, max_size=SENDFILE_MIN_SIZE, workers=WARMUP_WORKERS, walk=False, manifest=None, snapshot=None):
+        self.dir = None
+        self.cache = None
+        self.index = None
+        self.max_size = max_size
+        self.workers = workers
+        self.walk = walk
+        self.manifest = manifest
+        self.snapshot = snapshot
+        self.files = 0
+        self.bytes = 0
+        self.seconds = 0
+
+    def run(self, dir, cache, index=None):
+        self.dir = dir
+        self.cache = cache
+        self.index = index
+        started = perf_counter()
+        urls = self.get_urls()
+        with ThreadPool(self.workers) as pool:
+            for size in pool.imap(self.load, urls):
+                if size:
+                    self.files += 1
+                    self.bytes += size
+        self.seconds = perf_counter() - started
+        logging.info(f"Warm-up loaded {self.files} files, {self.bytes} bytes in {self.seconds:.2f}s")
+
+    def get_urls(self):
+        urls = []
+        for path in (self.manifest, self.snapshot):
+            if path and os.path.exists(path):
+                with open(path, encoding="utf8") as f:
+                    urls.extend(line.strip() for line in f if line.strip() and not line.startswith("#"))
+        if self.walk:
+            for root, _, names in os.walk(self.dir):
+                for name in names:
+                    path = os.path.join(root, name)
+                    urls.append(self.to_url(path))
+
+        budget = self.cache.max_bytes
+        selected = []
+        seen = set()
+        for url in urls:
+            if url in seen:
+                continue
+            seen.add(url)
+            try:
+                size = os.path.getsize(os.path.join(self.dir, unquote(url).lstrip("/")))
+            except OSError:
+                continue
+            if size > self.max_size or size > budget:
+                continue
+            budget -= size
+            selected.append(url)
+        return selected
+
+    def load(self, url):
+        response = Response(url, "GET", self.dir, self.cache, index=self.index)
+        response.load_content()
+        content = response.content
+        if content.content_status == OK and content.content is not None:
+            return content.content_len
+        return 0
+
+    def save(self):
+        if not self.snapshot or not self.cache:
+            return
+        urls = {}
+        for key in self.cache.keys():
+            path = key if isinstance(key, str) else key[0]
+            urls.setdefault(self.to_url(path))
+        temp = f"{self.snapshot}.{os.getpid()}"
+        with open(temp, "w", encoding="utf8") as f:
+            f.write("".join(url + "\n" for url in urls))
+        os.replace(temp, self.snapshot)
+
+    def to_url(self, path):
+        return "/" + quote(os.path.relpath(path, self.dir).replace(os.sep, "/"))
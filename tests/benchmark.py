@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+import argparse
+import asyncio
+import json
+import os
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HTTPD = os.path.join(ROOT, "app", "httpd.py")
+
+SMALL_SIZE = 1024
+LARGE_SIZE = 1024 * 1024
+
+WORKLOADS = {
+    "small": ("GET", "/small.html", False),
+    "large": ("GET", "/large.bin", False),
+    "404": ("GET", "/missing.html", False),
+    "head": ("HEAD", "/small.html", False),
+    "keep-alive": ("GET", "/small.html", True),
+}
+
+
+def make_documents(dir):
+    with open(os.path.join(dir, "small.html"), "wb") as f:
+        f.write(b"<html>" + b"x" * (SMALL_SIZE - 14) + b"</html>\n")
+    with open(os.path.join(dir, "large.bin"), "wb") as f:
+        f.write(os.urandom(LARGE_SIZE))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"Server did not start on port {port}")
+
+
+def start_server(root, port, server_args):
+    command = [sys.executable, HTTPD, "-p", str(port), "-r", root] + shlex.split(server_args)
+    process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+    except TimeoutError:
+        process.kill()
+        raise
+    return process
+
+
+async def read_response(reader, method):
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    length = 0
+    close = False
+    for line in head.split(b"\r\n")[1:]:
+        name, _, value = line.partition(b":")
+        name = name.strip().lower()
+        if name == b"content-length":
+            length = int(value)
+        elif name == b"connection":
+            close = value.strip().lower() == b"close"
+    if method != "HEAD" and length:
+        await reader.readexactly(length)
+    return status, close
+
+
+async def request_once(reader, writer, request, method):
+    writer.write(request)
+    await writer.drain()
+    return await read_response(reader, method)
+
+
+async def client(port, workload, counter, latencies, errors, timeout):
+    method, path, keep_alive = WORKLOADS[workload]
+    connection = b"keep-alive" if keep_alive else b"close"
+    request = f"{method} {path} HTTP/1.1\r\nHost: localhost\r\n".encode() + b"Connection: " + connection + b"\r\n\r\n"
+    reader = writer = None
+    while counter[0] > 0:
+        counter[0] -= 1
+        reuse = keep_alive
+        started = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), timeout)
+            status, close = await asyncio.wait_for(request_once(reader, writer, request, method), timeout)
+            reuse = reuse and not close
+            if status >= 500:
+                errors.append(status)
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError) as e:
+            errors.append(type(e).__name__)
+            reuse = False
+        else:
+            latencies.append(time.perf_counter() - started)
+        if not reuse and writer is not None:
+            writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+def percentile(values, percent):
+    if not values:
+        return None
+    index = min(int(len(values) * percent / 100), len(values) - 1)
+    return values[index]
+
+
+async def run_workload(port, workload, concurrency, requests, timeout):
+    counter = [requests]
+    latencies = []
+    errors = []
+    started = time.perf_counter()
+    await asyncio.gather(*(client(port, workload, counter, latencies, errors, timeout)
+                           for _ in range(concurrency)))
+    duration = time.perf_counter() - started
+
+    latencies.sort()
+    ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "duration": round(duration, 3),
+        "rps": round(len(latencies) / duration, 1) if duration else 0,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_row(workload, concurrency, result, previous=None):
+    line = (f"{workload:<12} c={concurrency:<5} {result['rps']:>10} req/s  "
+            f"p50 {result['p50_ms']} ms  p95 {result['p95_ms']} ms  p99 {result['p99_ms']} ms  "
+            f"errors {result['errors']}")
+    if previous and previous.get("rps"):
+        line += f"  ({(result['rps'] - previous['rps']) / previous['rps'] * 100:+.1f}% req/s)"
+    print(line, flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the server over loopback")
+    parser.add_argument("-n", "--requests", action="store", type=int, default=2000)
+    parser.add_argument("-c", "--concurrency", action="store", type=str, default="1,10,100,1000")
+    parser.add_argument("-W", "--workloads", action="store", type=str, default=",".join(WORKLOADS))
+    parser.add_argument("-t", "--timeout", action="store", type=float, default=10)
+    parser.add_argument("-s", "--server-args", action="store", type=str, default="")
+    parser.add_argument("-o", "--output", action="store", type=str, default=None)
+    parser.add_argument("--compare", action="store", type=str, default=None)
+    args = parser.parse_args()
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)["results"]
+
+    results = {}
+    with tempfile.TemporaryDirectory() as root:
+        make_documents(root)
+        port = free_port()
+        server = start_server(root, port, args.server_args)
+        try:
+            for workload in args.workloads.split(","):
+                results[workload] = {}
+                for concurrency in [int(c) for c in args.concurrency.split(",")]:
+                    result = asyncio.run(run_workload(port, workload, concurrency, args.requests, args.timeout))
+                    results[workload][str(concurrency)] = result
+                    print_row(workload, concurrency, result, previous.get(workload, {}).get(str(concurrency)))
+        finally:
+            server.terminate()
+            server.wait(timeout=10)
+
+    report = {
+        "revision": git_revision(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "server_args": args.server_args,
+        "requests": args.requests,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,12 +3,20 @@
 import sys
 v3 = sys.version_info[0] == 3
 
+import os
 import re
+import shutil
 import socket
+import subprocess
+import tempfile
 if v3:
   import http.client as httplib
+  import socketserver
 else:
   import httplib
+  import SocketServer as socketserver
+import threading
+import time
 import unittest
 
 class HttpServer(unittest.TestCase):
@@ -321,10 +329,516 @@ class HttpServer(unittest.TestCase):
     self.assertEqual(len(data), 35344)
     self.assertEqual(ctype, "application/x-shockwave-flash")
 
+  def test_range_single(self):
+    """range request returns 206 with the requested bytes"""
+    self.conn.request("GET", "/httptest/dir1/dir12/dir123/deep.txt", headers={"Range": "bytes=0-4"})
+    r = self.conn.getresponse()
+    data = r.read()
+    self.assertEqual(int(r.status), 206)
+    self.assertEqual(r.getheader("Content-Range"), "bytes 0-4/20")
+    self.assertEqual(int(r.getheader("Content-Length")), 5)
+    self.assertEqual(data, b"bingo")
+
+  def test_range_suffix(self):
+    """suffix range returns the last bytes"""
+    self.conn.request("GET", "/httptest/dir1/dir12/dir123/deep.txt", headers={"Range": "bytes=-4"})
+    r = self.conn.getresponse()
+    data = r.read()
+    self.assertEqual(int(r.status), 206)
+    self.assertEqual(r.getheader("Content-Range"), "bytes 16-19/20")
+    self.assertEqual(data, b" it\n")
+
+  def test_range_not_satisfiable(self):
+    """range past the end returns 416"""
+    self.conn.request("GET", "/httptest/dir1/dir12/dir123/deep.txt", headers={"Range": "bytes=100-200"})
+    r = self.conn.getresponse()
+    data = r.read()
+    self.assertEqual(int(r.status), 416)
+    self.assertEqual(r.getheader("Content-Range"), "bytes */20")
+
+  def test_range_multipart(self):
+    """several ranges return multipart/byteranges"""
+    self.conn.request("GET", "/httptest/dir1/dir12/dir123/deep.txt", headers={"Range": "bytes=0-4,11-15"})
+    r = self.conn.getresponse()
+    data = r.read()
+    ctype = r.getheader("Content-Type")
+    self.assertEqual(int(r.status), 206)
+    self.assertTrue(ctype.startswith("multipart/byteranges; boundary="))
+    boundary = ctype.split("=", 1)[1].encode("ascii")
+    self.assertEqual(int(r.getheader("Content-Length")), len(data))
+    parts = data.split(b"--" + boundary)
+    self.assertEqual(len(parts), 4)
+    self.assertIn(b"Content-Range: bytes 0-4/20\r\n\r\nbingo\r\n", parts[1])
+    self.assertIn(b"Content-Range: bytes 11-15/20\r\n\r\nfound\r\n", parts[2])
+    self.assertEqual(parts[3], b"--\r\n")
+
+  def test_if_range(self):
+    """If-Range with the current ETag keeps the range, a stale one returns the whole file"""
+    self.conn.request("GET", "/httptest/dir1/dir12/dir123/deep.txt")
+    r = self.conn.getresponse()
+    r.read()
+    etag = r.getheader("ETag")
+    self.conn.request("GET", "/httptest/dir1/dir12/dir123/deep.txt", headers={"Range": "bytes=0-4", "If-Range": etag})
+    r = self.conn.getresponse()
+    data = r.read()
+    self.assertEqual(int(r.status), 206)
+    self.assertEqual(data, b"bingo")
+    self.conn.request("GET", "/httptest/dir1/dir12/dir123/deep.txt",
+                      headers={"Range": "bytes=0-4", "If-Range": '"stale"'})
+    r = self.conn.getresponse()
+    data = r.read()
+    self.assertEqual(int(r.status), 200)
+    self.assertEqual(len(data), 20)
+
+  def raw_request(self, data):
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.settimeout(10)
+    s.connect((self.host, self.port))
+    s.sendall(data)
+    data = b""
+    while 1:
+      buf = s.recv(1024)
+      if not buf: break
+      data += buf
+    s.close()
+    return data
+
+  def test_keep_alive(self):
+    """persistent connection serves several requests"""
+    self.conn.request("GET", "/httptest/dir2/page.html")
+    r = self.conn.getresponse()
+    r.read()
+    sock = self.conn.sock
+    self.assertIsNotNone(sock)
+    self.conn.request("GET", "/httptest/dir1/dir12/dir123/deep.txt")
+    r = self.conn.getresponse()
+    data = r.read()
+    self.assertEqual(int(r.status), 200)
+    self.assertIs(self.conn.sock, sock)
+    self.assertEqual(data, b"bingo, you found it\n")
+
+  def test_pipelining(self):
+    """pipelined requests are answered in order"""
+    data = self.raw_request(b"GET /httptest/dir1/dir12/dir123/deep.txt HTTP/1.1\r\nHost: localhost\r\n\r\n"
+                            b"HEAD /httptest/dir2/page.html HTTP/1.1\r\nHost: localhost\r\n\r\n"
+                            b"GET /httptest/dir2/ HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n")
+    self.assertEqual(data.count(b"HTTP/1.1 200 OK"), 3)
+    first = data.find(b"bingo, you found it\n")
+    second = data.find(b"Content-Length: 38")
+    third = data.find(b"<html>Directory index file</html>\n")
+    self.assertTrue(0 < first < second < third)
+    self.assertTrue(data.endswith(b"<html>Directory index file</html>\n"))
+
+  def test_pipelining_body(self):
+    """request body is skipped before the next pipelined request"""
+    body = b"GET /httptest/dir2/ HTTP/1.1\r\n\r\n"
+    data = self.raw_request(b"POST /httptest/dir2/page.html HTTP/1.1\r\nHost: localhost\r\n"
+                            b"Content-Length: " + str(len(body)).encode("ascii") + b"\r\n\r\n" + body +
+                            b"GET /httptest/dir2/ HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n")
+    self.assertEqual(data.count(b"HTTP/1.1 "), 2)
+    self.assertEqual(data.count(b"HTTP/1.1 200 OK"), 1)
+
+  def test_conditional_etag(self):
+    """If-None-Match with the current ETag returns 304"""
+    self.conn.request("GET", "/httptest/dir2/page.html")
+    r = self.conn.getresponse()
+    r.read()
+    etag = r.getheader("ETag")
+    self.assertIsNotNone(etag)
+    self.conn.request("GET", "/httptest/dir2/page.html", headers={"If-None-Match": etag})
+    r = self.conn.getresponse()
+    data = r.read()
+    self.assertEqual(int(r.status), 304)
+    self.assertEqual(r.getheader("ETag"), etag)
+    self.assertEqual(len(data), 0)
+
+  def test_conditional_modified_since(self):
+    """If-Modified-Since with Last-Modified returns 304"""
+    self.conn.request("GET", "/httptest/dir2/page.html")
+    r = self.conn.getresponse()
+    r.read()
+    modified = r.getheader("Last-Modified")
+    self.conn.request("GET", "/httptest/dir2/page.html", headers={"If-Modified-Since": modified})
+    r = self.conn.getresponse()
+    data = r.read()
+    self.assertEqual(int(r.status), 304)
+    self.assertEqual(len(data), 0)
+
+  def test_head_encoding(self):
+    """HEAD sends the headers GET would send for the same Accept-Encoding"""
+    heads = []
+    for method in ("GET", "HEAD"):
+      self.conn.request(method, "/httptest/splash.css", headers={"Accept-Encoding": "gzip"})
+      r = self.conn.getresponse()
+      r.read()
+      heads.append((r.status, r.getheader("Content-Length"), r.getheader("Content-Encoding"), r.getheader("ETag")))
+    self.assertEqual(heads[0], heads[1])
+    self.assertEqual(heads[0][2], "gzip")
+
+  def test_header_too_large(self):
+    """oversized request head returns 431"""
+    self.conn.request("GET", "/httptest/dir2/page.html", headers={"X-Large": "a" * 16384})
+    r = self.conn.getresponse()
+    data = r.read()
+    self.assertEqual(int(r.status), 431)
+
+  def test_too_many_headers(self):
+    """too many header fields return 431"""
+    headers = dict(("X-Header-%d" % i, "1") for i in range(200))
+    self.conn.request("GET", "/httptest/dir2/page.html", headers=headers)
+    r = self.conn.getresponse()
+    data = r.read()
+    self.assertEqual(int(r.status), 431)
+
+  def test_chunked_request_body(self):
+    """chunked request body on a static path is refused, not parsed as a request"""
+    data = self.raw_request(b"POST /httptest/dir2/page.html HTTP/1.1\r\nHost: localhost\r\n"
+                            b"Transfer-Encoding: chunked\r\n\r\n5\r\nhello\r\n0\r\n\r\n")
+    self.assertTrue(data.startswith(b"HTTP/1.1 411 "))
+    self.assertEqual(data.count(b"HTTP/1.1 "), 1)
+
+  def test_bad_content_length(self):
+    """invalid Content-Length returns 400"""
+    data = self.raw_request(b"POST /httptest/dir2/page.html HTTP/1.1\r\nHost: localhost\r\n"
+                            b"Content-Length: -5\r\n\r\nhello")
+    self.assertTrue(data.startswith(b"HTTP/1.1 400 "))
+    self.assertEqual(data.count(b"HTTP/1.1 "), 1)
+
+  def test_invalid_header_field(self):
+    """header names that are not tokens and values with control characters return 400"""
+    for line in (b"Bad Name: 1", b"X-Null: a\x00b", b"X-CR: a\rb", b"no colon"):
+      data = self.raw_request(b"GET /httptest/dir2/page.html HTTP/1.1\r\nHost: localhost\r\n" + line + b"\r\n\r\n")
+      self.assertTrue(data.startswith(b"HTTP/1.1 400 "), line)
+
+class ServerCase(unittest.TestCase):
+  """Starts app/httpd.py with `args` on a free port and a temporary document root holding `files`"""
+  host = "127.0.0.1"
+  args = []
+  files = {}
+
+  @classmethod
+  def setUpClass(cls):
+    cls.root = tempfile.mkdtemp()
+    for name, data in cls.files.items():
+      with open(os.path.join(cls.root, name), "wb") as f:
+        f.write(data)
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind((cls.host, 0))
+    cls.port = s.getsockname()[1]
+    s.close()
+    httpd = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app", "httpd.py")
+    cls.log = open(os.devnull, "wb")
+    cls.process = subprocess.Popen([sys.executable, httpd, "-p", str(cls.port), "-r", cls.root] + cls.args,
+                                   stdout=cls.log, stderr=subprocess.STDOUT)
+    for i in range(100):
+      try:
+        socket.create_connection((cls.host, cls.port), 1).close()
+        return
+      except socket.error:
+        time.sleep(0.1)
+    cls.tearDownClass()
+    raise RuntimeError("server did not start on port %d" % cls.port)
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.process.kill()
+    cls.process.wait()
+    cls.log.close()
+    shutil.rmtree(cls.root)
+
+  def connect(self):
+    return socket.create_connection((self.host, self.port), 10)
+
+  def read_all(self, s):
+    data = b""
+    while 1:
+      try:
+        buf = s.recv(65536)
+      except socket.error:
+        break
+      if not buf: break
+      data += buf
+    return data
+
+class LoadShedding(ServerCase):
+  args = ["-w", "1", "--max-workers", "1", "--queue-size", "1"]
+  files = {"index.html": b"<html>index</html>\n"}
+
+  def test_queue_full(self):
+    """connections beyond the queue get 503 with Retry-After, queued ones are still served"""
+    time.sleep(0.3)
+    busy = self.connect()
+    time.sleep(0.3)
+    queued = self.connect()
+    time.sleep(0.3)
+    rejected = self.connect()
+    data = self.read_all(rejected)
+    rejected.close()
+    self.assertTrue(data.startswith(b"HTTP/1.1 503 "))
+    self.assertIn(b"Retry-After: ", data)
+    busy.close()
+    queued.sendall(b"GET / HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n")
+    data = self.read_all(queued)
+    queued.close()
+    self.assertTrue(data.startswith(b"HTTP/1.1 200 "))
+
+class SlowClients(ServerCase):
+  args = ["--header-timeout", "1", "--send-timeout", "1", "--min-rate", "0"]
+  files = {"index.html": b"<html>index</html>\n", "big.bin": b"x" * (8 * 1024 * 1024)}
+
+  def test_header_timeout(self):
+    """a client trickling header lines is cut off at the header deadline"""
+    s = self.connect()
+    started = time.time()
+    s.sendall(b"GET / HTTP/1.1\r\n")
+    while time.time() - started < 5:
+      time.sleep(0.2)
+      try:
+        s.sendall(b"X-Slow: 1\r\n")
+      except socket.error:
+        break
+    elapsed = time.time() - started
+    data = self.read_all(s)
+    s.close()
+    self.assertLess(elapsed, 3)
+    self.assertFalse(data.startswith(b"HTTP/1.1 200 "))
+
+  def test_send_timeout(self):
+    """a client that stops reading is dropped at the send deadline"""
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 65536)
+    s.settimeout(10)
+    s.connect((self.host, self.port))
+    s.sendall(b"GET /big.bin HTTP/1.1\r\nHost: localhost\r\n\r\n")
+    time.sleep(2.5)
+    data = self.read_all(s)
+    s.close()
+    self.assertTrue(data.startswith(b"HTTP/1.1 200 "))
+    self.assertLess(len(data), len(self.files["big.bin"]))
+
+class MimeTypes(ServerCase):
+  args = ["--mime-type", "md=text/markdown", "--cache-control", "image/*=3600", "--cache-control", "text/css=60"]
+  files = {"notes.md": b"# notes\n", "NOTES.MD": b"# notes\n", "data.xyz": b"data", "pic.png": b"png",
+           "style.css": b"body {}\n", "page.html": b"<html>page</html>\n"}
+
+  def setUp(self):
+    self.conn = httplib.HTTPConnection(self.host, self.port, timeout=10)
+
+  def tearDown(self):
+    self.conn.close()
+
+  def get(self, path, headers=None):
+    self.conn.request("GET", path, headers=headers or {})
+    r = self.conn.getresponse()
+    r.read()
+    return r
+
+  def test_extension_override(self):
+    """--mime-type maps an extension case-insensitively, unknown ones get application/octet-stream"""
+    self.assertEqual(self.get("/notes.md").getheader("Content-Type"), "text/markdown")
+    self.assertEqual(self.get("/NOTES.MD").getheader("Content-Type"), "text/markdown")
+    self.assertEqual(self.get("/data.xyz").getheader("Content-Type"), "application/octet-stream")
+
+  def test_cache_control(self):
+    """Cache-Control follows the exact type, then the type family, and is absent without a policy"""
+    self.assertEqual(self.get("/pic.png").getheader("Cache-Control"), "public, max-age=3600")
+    self.assertEqual(self.get("/style.css").getheader("Cache-Control"), "public, max-age=60")
+    self.assertIsNone(self.get("/page.html").getheader("Cache-Control"))
+    self.assertIsNone(self.get("/missing.png").getheader("Cache-Control"))
+
+  def test_cache_control_not_modified(self):
+    """304 repeats the Cache-Control of the full response"""
+    etag = self.get("/pic.png").getheader("ETag")
+    r = self.get("/pic.png", {"If-None-Match": etag})
+    self.assertEqual(int(r.status), 304)
+    self.assertEqual(r.getheader("Cache-Control"), "public, max-age=3600")
+
+class SingleFlight(ServerCase):
+  args = ["--metrics-path", "/metrics"]
+  files = {"log.txt": b"".join(("line %d of the log\n" % i).encode("ascii") for i in range(150000))}
+
+  def metric(self, name):
+    conn = httplib.HTTPConnection(self.host, self.port, timeout=10)
+    conn.request("GET", "/metrics")
+    data = conn.getresponse().read().decode("ascii")
+    conn.close()
+    return int(re.search(r"^%s (\d+)" % name, data, re.M).group(1))
+
+  def test_concurrent_misses(self):
+    """concurrent requests for an uncached gzip variant compress it once"""
+    start = threading.Event()
+    results = []
+    def fetch():
+      conn = httplib.HTTPConnection(self.host, self.port, timeout=10)
+      start.wait()
+      conn.request("GET", "/log.txt", headers={"Accept-Encoding": "gzip"})
+      r = conn.getresponse()
+      results.append((r.status, r.getheader("Content-Encoding"), r.read()))
+      conn.close()
+    threads = [threading.Thread(target=fetch) for i in range(16)]
+    for t in threads:
+      t.start()
+    start.set()
+    for t in threads:
+      t.join()
+    self.assertEqual(len(results), 16)
+    self.assertEqual(len(set(results)), 1)
+    self.assertEqual(results[0][:2], (200, "gzip"))
+    self.assertEqual(self.metric("cache_misses_total"), 1)
+    self.assertEqual(self.metric("cache_coalesced_total") + self.metric("cache_hits_total"), 15)
+
+class Backend(socketserver.StreamRequestHandler):
+  """Stand-in upstream for ProxyServer, answers /proxy/* with raw HTTP/1.1 framing"""
+  connections = 0
+
+  def handle(self):
+    Backend.connections += 1
+    while 1:
+      line = self.rfile.readline()
+      if not line: return
+      method, path = line.split()[:2]
+      length = 0
+      while 1:
+        header = self.rfile.readline()
+        if header in (b"\r\n", b""): break
+        name, _, value = header.partition(b":")
+        if name.strip().lower() == b"content-length":
+          length = int(value)
+      body = self.rfile.read(length)
+      if path == b"/proxy/chunked":
+        self.wfile.write(b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+                         b"5\r\nhello\r\n6;ext=1\r\n world\r\n0\r\n\r\n")
+      else:
+        data = method + b" " + path + b" " + body
+        self.wfile.write(b"HTTP/1.1 200 OK\r\nContent-Length: " + str(len(data)).encode("ascii") + b"\r\n\r\n" + data)
+      if path == b"/proxy/once":
+        return
+
+
+class ProxyServer(unittest.TestCase):
+  """Needs the server started with --proxy /proxy=127.0.0.1:8081"""
+  host = HttpServer.host
+  port = HttpServer.port
+  backend_port = 8081
+
+  @classmethod
+  def setUpClass(cls):
+    socketserver.ThreadingTCPServer.allow_reuse_address = True
+    cls.backend = socketserver.ThreadingTCPServer(("127.0.0.1", cls.backend_port), Backend)
+    cls.backend.daemon_threads = True
+    threading.Thread(target=cls.backend.serve_forever).start()
+    conn = httplib.HTTPConnection(cls.host, cls.port, timeout=10)
+    conn.request("GET", "/proxy/ping")
+    r = conn.getresponse()
+    r.read()
+    conn.close()
+    if r.status == 404:
+      cls.tearDownClass()
+      raise unittest.SkipTest("server not started with --proxy /proxy=127.0.0.1:%d" % cls.backend_port)
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.backend.shutdown()
+    cls.backend.server_close()
+
+  def setUp(self):
+    self.conn = httplib.HTTPConnection(self.host, self.port, timeout=10)
+
+  def tearDown(self):
+    self.conn.close()
+
+  def test_content_length(self):
+    """upstream Content-Length body is relayed"""
+    self.conn.request("GET", "/proxy/length?q=1")
+    r = self.conn.getresponse()
+    data = r.read()
+    self.assertEqual(int(r.status), 200)
+    self.assertEqual(int(r.getheader("Content-Length")), len(data))
+    self.assertEqual(data, b"GET /proxy/length?q=1 ")
+
+  def test_request_body(self):
+    """request body is streamed to the upstream"""
+    body = b"x" * 100000
+    self.conn.request("POST", "/proxy/post", body=body)
+    r = self.conn.getresponse()
+    data = r.read()
+    self.assertEqual(int(r.status), 200)
+    self.assertEqual(data, b"POST /proxy/post " + body)
+
+  def test_chunked(self):
+    """chunked upstream body is relayed chunked to HTTP/1.1 clients"""
+    self.conn.request("GET", "/proxy/chunked")
+    r = self.conn.getresponse()
+    data = r.read()
+    self.assertEqual(int(r.status), 200)
+    self.assertEqual(r.getheader("Transfer-Encoding"), "chunked")
+    self.assertEqual(data, b"hello world")
+
+  def test_chunked_http10(self):
+    """chunked upstream body is de-chunked and the connection closed for HTTP/1.0 clients"""
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.settimeout(10)
+    s.connect((self.host, self.port))
+    s.sendall(b"GET /proxy/chunked HTTP/1.0\r\n\r\n")
+    data = b""
+    while 1:
+      buf = s.recv(1024)
+      if not buf: break
+      data += buf
+    s.close()
+    head, body = data.split(b"\r\n\r\n", 1)
+    self.assertTrue(head.startswith(b"HTTP/1.1 200 "))
+    self.assertNotIn(b"Transfer-Encoding", head)
+    self.assertIn(b"Connection: close", head)
+    self.assertEqual(body, b"hello world")
+
+  def test_pooled_connection(self):
+    """sequential requests reuse one upstream connection"""
+    self.conn.request("GET", "/proxy/length")
+    self.conn.getresponse().read()
+    connections = Backend.connections
+    for i in range(3):
+      self.conn.request("GET", "/proxy/length")
+      r = self.conn.getresponse()
+      r.read()
+      self.assertEqual(int(r.status), 200)
+    self.assertEqual(Backend.connections, connections)
+
+  def test_stale_connection_retry(self):
+    """request on a pooled connection the upstream has closed is retried on a fresh one"""
+    self.conn.request("GET", "/proxy/once")
+    r = self.conn.getresponse()
+    r.read()
+    time.sleep(0.2)
+    connections = Backend.connections
+    self.conn.request("GET", "/proxy/length")
+    r = self.conn.getresponse()
+    data = r.read()
+    self.assertEqual(int(r.status), 200)
+    self.assertEqual(data, b"GET /proxy/length ")
+    self.assertEqual(Backend.connections, connections + 1)
+
+  def test_prefix_segments(self):
+    """routes match whole path segments of the decoded, normalized path"""
+    for path in ("/proxyfoo", "/proxy/../httptest/dir2/page.html", "/%70roxy/../httptest/dir2/page.html"):
+      self.conn.request("GET", path)
+      r = self.conn.getresponse()
+      data = r.read()
+      self.assertFalse(data.startswith(b"GET "), path)
+    self.conn.request("GET", "/%70roxy/length")
+    r = self.conn.getresponse()
+    data = r.read()
+    self.assertEqual(data, b"GET /%70roxy/length ")
+
 loader = unittest.TestLoader()
 suite = unittest.TestSuite()
 a = loader.loadTestsFromTestCase(HttpServer)
 suite.addTest(a)
+suite.addTest(loader.loadTestsFromTestCase(LoadShedding))
+suite.addTest(loader.loadTestsFromTestCase(SlowClients))
+suite.addTest(loader.loadTestsFromTestCase(MimeTypes))
+suite.addTest(loader.loadTestsFromTestCase(SingleFlight))
+suite.addTest(loader.loadTestsFromTestCase(ProxyServer))
 
 class NewResult(unittest.TextTestResult):
   def getDescription(self, test):